@@ -0,0 +1,94 @@
+"""Benchmark of the history DataFrame dtypes: plain object/float64 columns against df_def.TIPOS_HIST.
+
+For each history length a synthetic SQLite database is built and its history read twice, as
+pd.read_sql_query returns it and through execute_queries_df_hist, which applies tipar_historial.
+The memory of both frames and the time of the group-bys and category filters that the Resumen page
+and ext_ejecution run on them are compared.
+
+Usage:
+    python benchmarks/bench_dtypes.py [--holdings 200] [--dias 90 365 1095] [--repeticiones 5]
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench_refresh import crear_base  # noqa: E402
+from utils.db_conn import obtener_pool  # noqa: E402
+from utils.df_def import execute_queries_df_hist, hist_day_cat_summary, agrupado_ticker_resumen  # noqa: E402
+
+
+SQL_HIST = '''SELECT id_registro, fecha_compra, categoria, ticker, CAST(cantidad AS FLOAT) AS cantidad, monto, valor_actual, fecha_upd
+    FROM historical_holdings ORDER BY fecha_upd desc, id_registro desc'''
+
+
+def leer_sin_tipar(conexion):
+    """Read the history with the dtypes pd.read_sql_query infers, like execute_queries_df_hist did before TIPOS_HIST."""
+    df_hist = pd.read_sql_query(SQL_HIST, conexion)
+    df_hist['monto_actual'] = df_hist['valor_actual'] * df_hist['cantidad']
+    df_hist['diferencia'] = df_hist['monto_actual'] - df_hist['monto']
+    df_hist['gan%'] = df_hist['diferencia'] / df_hist['monto'] * 100
+    return df_hist
+
+
+def medir(funcion, repeticiones):
+    """Return the best of several runs of funcion, in seconds."""
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    return min(tiempos)
+
+
+def comparar(path, repeticiones):
+    """Return the rows, memory and timings of the untyped and typed history of a database."""
+    obtener_pool(path)
+    conexion = sqlite3.connect(path)
+    resultados = {}
+    for nombre, leer in (('sin tipar', leer_sin_tipar), ('tipado', lambda c: execute_queries_df_hist(SQL_HIST, c))):
+        lectura = medir(lambda: leer(conexion), repeticiones)
+        df_hist = leer(conexion)
+        resultados[nombre] = {
+            'filas': len(df_hist),
+            'MB': df_hist.memory_usage(deep=True).sum() / 2**20,
+            'lectura': lectura,
+            'dia_cat': medir(lambda: hist_day_cat_summary(df_hist), repeticiones),
+            'ticker': medir(lambda: agrupado_ticker_resumen(df_hist, listas=False), repeticiones),
+            'filtro': medir(lambda: [df_hist[df_hist['categoria'].str.contains(c)] for c in ('FCI', 'Cedear', 'Accion', 'USD')], repeticiones),
+        }
+    conexion.close()
+    return resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--holdings', type=int, default=200, help='registros por portfolio')
+    parser.add_argument('--dias', type=int, nargs='+', default=[90, 365, 1095])
+    parser.add_argument('--repeticiones', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'dias':>5} {'dtypes':>9} {'filas':>8} {'MB':>7} {'lectura':>8} {'dia_cat':>8} {'ticker':>8} {'filtro':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for dias in args.dias:
+            path = os.path.join(tmp, f'bench_{dias}.db')
+            crear_base(path, args.holdings, dias)
+            resultados = comparar(path, args.repeticiones)
+            for nombre, r in resultados.items():
+                print(f"{dias:>5} {nombre:>9} {r['filas']:>8} {r['MB']:>7.1f} {r['lectura']:>8.3f} {r['dia_cat']:>8.3f} "
+                      f"{r['ticker']:>8.3f} {r['filtro']:>8.3f}")
+            antes, despues = resultados['sin tipar'], resultados['tipado']
+            print(f"{'':>5} {'mejora':>9} {'':>8} {antes['MB'] / despues['MB']:>6.1f}x {antes['lectura'] / despues['lectura']:>7.1f}x "
+                  f"{antes['dia_cat'] / despues['dia_cat']:>7.1f}x {antes['ticker'] / despues['ticker']:>7.1f}x {antes['filtro'] / despues['filtro']:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""Benchmark of the bullmarket FCI page parsers.
+
+Compares parse_fci_page (targeted HTMLParser) against parse_fci_page_read_html (pd.read_html) on the
+saved FundData fixtures, reporting time per page and peak memory.
+
+Usage:
+    python benchmarks/bench_fci_parser.py [repeticiones]
+"""
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from utils.quotes import parse_fci_page, parse_fci_page_read_html  # noqa: E402
+
+
+FIXTURES = Path(__file__).resolve().parent / 'fixtures'
+
+
+def medir(parser, paginas, repeticiones):
+    """Return the mean seconds per page and the peak traced memory of a parser."""
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        for html in paginas:
+            parser(html)
+    segundos = (time.perf_counter() - inicio) / (repeticiones * len(paginas))
+
+    tracemalloc.start()
+    for html in paginas:
+        parser(html)
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return segundos, pico
+
+
+def main():
+    repeticiones = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    paginas = [path.read_text(encoding='utf-8') for path in sorted(FIXTURES.glob('fci_*.html'))]
+
+    for html in paginas:
+        valor, fecha = parse_fci_page(html)
+        valor_ref, fecha_ref = parse_fci_page_read_html(html)
+        assert (valor, fecha) == (float(valor_ref), fecha_ref), "Los parsers no coinciden"
+
+    resultados = {
+        'parse_fci_page': medir(parse_fci_page, paginas, repeticiones),
+        'pd.read_html': medir(parse_fci_page_read_html, paginas, repeticiones),
+    }
+
+    print(f"{len(paginas)} paginas x {repeticiones} repeticiones")
+    for nombre, (segundos, pico) in resultados.items():
+        print(f"{nombre:<16} {segundos * 1000:8.3f} ms/pagina {pico / 1024:10.1f} KiB pico")
+
+    base = resultados['pd.read_html'][0]
+    print(f"speedup: {base / resultados['parse_fci_page'][0]:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
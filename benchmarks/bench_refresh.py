@@ -0,0 +1,158 @@
+"""Benchmark of a full ext_ejecution.py-style refresh against the local replay server.
+
+For each portfolio size a synthetic SQLite database is built and refreshed with actualizar and
+appendear_historical, the summary frames are computed and the Telegram message is sent, all against
+ReplayServer instead of the live endpoints. Yahoo quotes are fetched like fetch_acciones does, all the
+tickers of the refresh in one request, through the server spark endpoint instead of yfinance.
+
+Usage:
+    python benchmarks/bench_refresh.py [--holdings 10 50 200] [--latencia 50] [--errores 0.0]
+"""
+import argparse
+import datetime as dt
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from replay_server import ReplayServer  # noqa: E402
+from utils import quotes, telegram_post  # noqa: E402
+from utils.db_conn import conexionDB  # noqa: E402
+from utils.functions import actualizar, appendear_historical  # noqa: E402
+from utils.migrations import TABLAS_FINANCE  # noqa: E402
+from utils.df_def import execute_queries_df_last, execute_queries_df_hist, last_cat_ev_summ, last_cat_ev_summ_cat, agrupado_ticker_resumen  # noqa: E402
+
+
+CATEGORIAS = ['1. FCI', '2. Cedear', '3. Accion', '4. USD']
+
+COLUMNAS = '''id_registro INTEGER PRIMARY KEY AUTOINCREMENT,
+    fecha_compra TIMESTAMP,
+    categoria VARCHAR(100),
+    ticker VARCHAR(100),
+    cantidad VARCHAR(100),
+    monto FLOAT,
+    valor_actual FLOAT,
+    fecha_upd TIMESTAMP'''
+
+
+def crear_base(path, holdings, dias=30):
+    """Create a synthetic database with holdings records per portfolio and dias of history.
+
+    The tables use the per-portfolio layout, which the migrations convert when the database is
+    first opened. About half of the holdings share their ticker with another one, like repeated purchases.
+    """
+    conexion = sqlite3.connect(path)
+    inicio = dt.date.today() - dt.timedelta(days=dias)
+    for table in TABLAS_FINANCE:
+        sufijo = table[len('finance'):]
+        conexion.execute(f'CREATE TABLE {table}({COLUMNAS})')
+        conexion.execute(f'CREATE TABLE historical_finance_invertions{sufijo}({COLUMNAS.replace(" PRIMARY KEY AUTOINCREMENT", "")})')
+
+        registros = []
+        for i in range(holdings):
+            categoria = CATEGORIAS[i % len(CATEGORIAS)]
+            ticker = 'USD' if categoria == '4. USD' else f'{categoria[3:].upper()}{i // 2}'
+            registros.append((str(inicio), categoria, ticker, str(10 + i), 1000.0 + i, 100.0, str(inicio)))
+        conexion.executemany(f'''INSERT INTO {table}(fecha_compra, categoria, ticker, cantidad, monto, valor_actual, fecha_upd)
+            VALUES(?, ?, ?, ?, ?, ?, ?)''', registros)
+
+        for dia in range(dias):
+            conexion.execute(f'''INSERT INTO historical_finance_invertions{sufijo}
+                SELECT id_registro, fecha_compra, categoria, ticker, cantidad, monto, valor_actual * (1 + {dia} / 100.0), '{inicio + dt.timedelta(days=dia)}'
+                FROM {table}''')
+    conexion.commit()
+    conexion.close()
+
+
+def configurar(server):
+    """Point the quote sources and Telegram at the replay server."""
+    quotes.FCI_URL = server.fci_url
+    quotes.USD_URL = server.usd_url
+    telegram_post.TELEGRAM_URL = server.url
+    os.environ.setdefault('ST_BOT_TOKEN', 'bench')
+    os.environ.setdefault('ST_BOT_CHATID', '0')
+
+    def fetch_acciones_replay(tickers):
+        url = f'{server.url}/v7/finance/spark'
+        res = quotes.get_session(url).get(url, params={'symbols': ','.join(tickers), 'range': '5d', 'interval': '1d'})
+        res.raise_for_status()
+        graficos = {r['symbol']: r['response'][0] for r in res.json()['spark']['result']}
+
+        resultados = {}
+        for ticker in tickers:
+            try:
+                grafico = graficos[ticker]
+                fecha = dt.datetime.fromtimestamp(grafico['timestamp'][-1]).date()
+                resultados[ticker] = (grafico['indicators']['quote'][0]['close'][-1], fecha)
+            except Exception as e:
+                resultados[ticker] = e
+        return resultados
+
+    quotes.BATCH_FETCHERS['yf'] = fetch_acciones_replay
+
+
+def refrescar(path):
+    """Run one ext_ejecution.py-style refresh and return the seconds spent in each phase."""
+    tiempos = {}
+
+    inicio = time.perf_counter()
+    conexion = conexionDB(path)
+    actualizar(conexion)
+    tiempos['actualizar'] = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    appendear_historical(conexion)
+    conexion.cerrar()
+    tiempos['historico'] = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    lectura = sqlite3.connect(path)
+    columnas = 'id_registro, fecha_compra, categoria, ticker, CAST(cantidad AS FLOAT) AS cantidad, monto, valor_actual, fecha_upd'
+    df_last = execute_queries_df_last(f"SELECT {columnas} FROM holdings WHERE portfolio = 'principal' ORDER BY fecha_upd desc, id_registro desc", lectura)
+    df_hist = execute_queries_df_hist(f"SELECT {columnas} FROM historical_holdings WHERE portfolio = 'principal' ORDER BY fecha_upd desc, id_registro desc", lectura)
+    lectura.close()
+    df_last_cat_ev_summ = last_cat_ev_summ(df_last=df_last, df_hist=df_hist)
+    last_cat_ev_summ_cat(df_last=df_last, df_hist=df_hist)
+    agrupado_ticker_resumen(df_hist=df_hist)
+    tiempos['resumen'] = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    try:
+        telegram_post.telegram_bot_sendtext(f"Portafolio: {df_last_cat_ev_summ['porcentaje_diferencia'][0]}%")
+    except Exception as e:
+        print("Error telegram: ", e)
+    tiempos['telegram'] = time.perf_counter() - inicio
+    return tiempos
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--holdings', type=int, nargs='+', default=[10, 50, 200])
+    parser.add_argument('--latencia', type=float, default=50.0, help='milisegundos por request')
+    parser.add_argument('--errores', type=float, default=0.0, help='fraccion de requests con 503')
+    args = parser.parse_args()
+
+    with ReplayServer(latencia=args.latencia / 1000, errores=args.errores) as server, tempfile.TemporaryDirectory() as tmp:
+        configurar(server)
+        print(f"latencia {args.latencia:.0f} ms, errores {args.errores:.0%}")
+        print(f"{'holdings':>8} {'requests':>8} {'actualizar':>10} {'historico':>9} {'resumen':>8} {'telegram':>8} {'total':>8} {'holdings/s':>10}")
+        for holdings in args.holdings:
+            path = os.path.join(tmp, f'bench_{holdings}.db')
+            crear_base(path, holdings)
+            server.requests.clear()
+
+            tiempos = refrescar(path)
+
+            total = sum(tiempos.values())
+            registros = holdings * len(TABLAS_FINANCE)
+            print(f"{holdings:>8} {sum(server.requests.values()):>8} {tiempos['actualizar']:>10.3f} {tiempos['historico']:>9.3f} "
+                  f"{tiempos['resumen']:>8.3f} {tiempos['telegram']:>8.3f} {total:>8.3f} {registros / total:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
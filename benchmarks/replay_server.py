@@ -0,0 +1,218 @@
+"""Local stand-in for the bullmarket, bluelytics, Yahoo and Telegram endpoints.
+
+Serves the responses captured in benchmarks/fixtures with a configurable latency and error rate, so a
+refresh can be measured reproducibly on a machine with no network.
+
+Usage:
+    python benchmarks/replay_server.py servir [--puerto 8765] [--latencia 50] [--errores 0.0]
+    python benchmarks/replay_server.py grabar FCI1 FCI2 ... [--acciones AAPL KO ...]
+
+While serving, point the app at it with the ST_FCI_URL, ST_USD_URL and ST_TELEGRAM_URL environment
+variables printed at startup.
+"""
+import argparse
+import datetime as dt
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+
+
+FIXTURES = Path(__file__).resolve().parent / 'fixtures'
+
+FCI_URL = "https://www.bullmarketbrokers.com/Information/FundData?ticker={ticker}"
+USD_URL = "https://api.bluelytics.com.ar/v2/latest"
+YAHOO_SPARK_URL = "https://query1.finance.yahoo.com/v7/finance/spark"
+
+
+class _ReplayHandler(BaseHTTPRequestHandler):
+    """Route each request to its captured response."""
+
+    def do_GET(self):
+        server = self.server
+        time.sleep(server.latencia)
+
+        url = urlsplit(self.path)
+        with server.lock:
+            server.requests[url.path.split('/')[1]] = server.requests.get(url.path.split('/')[1], 0) + 1
+            fallar = server.random.random() < server.errores
+        if fallar:
+            return self._responder(503, 'text/plain', b'error inyectado')
+
+        if url.path == '/Information/FundData':
+            ticker = parse_qs(url.query).get('ticker', [''])[0]
+            return self._responder(200, 'text/html; charset=utf-8', server.fci_page(ticker))
+        if url.path == '/v2/latest':
+            return self._responder(200, 'application/json', server.fixture('bluelytics_latest.json'))
+        if url.path == '/v7/finance/spark':
+            tickers = parse_qs(url.query).get('symbols', [''])[0].split(',')
+            return self._responder(200, 'application/json', server.yahoo_spark(tickers))
+        if url.path.startswith('/bot') and url.path.endswith('/sendMessage'):
+            return self._responder(200, 'application/json', b'{"ok": true, "result": {}}')
+        return self._responder(404, 'text/plain', b'sin fixture')
+
+    def _responder(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ReplayServer(ThreadingHTTPServer):
+    """Threaded HTTP server replaying captured quote responses.
+
+    Attributes:
+        latencia (float): Seconds slept before answering each request.
+        errores (float): Fraction of requests answered with a 503.
+        requests (dict): Count of requests served per first path segment.
+
+    Usage:
+        with ReplayServer(latencia=0.05) as server:
+            quotes.FCI_URL = server.fci_url
+    """
+
+    daemon_threads = True
+
+    def __init__(self, puerto=0, latencia=0.0, errores=0.0, fixtures=FIXTURES, semilla=0):
+        super().__init__(('127.0.0.1', puerto), _ReplayHandler)
+        self.latencia = latencia
+        self.errores = errores
+        self.fixtures = Path(fixtures)
+        self.random = random.Random(semilla)
+        self.lock = threading.Lock()
+        self.requests = {}
+        self._cache = {}
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    @property
+    def fci_url(self):
+        return self.url + '/Information/FundData?ticker={ticker}'
+
+    @property
+    def usd_url(self):
+        return self.url + '/v2/latest'
+
+    def fixture(self, nombre):
+        """Return the bytes of a fixture file, read once."""
+        if nombre not in self._cache:
+            self._cache[nombre] = (self.fixtures / nombre).read_bytes()
+        return self._cache[nombre]
+
+    def fci_page(self, ticker):
+        """Return the captured FundData page of a ticker, or the generic one if it wasn't recorded."""
+        if (self.fixtures / f'fci_{ticker}.html').exists():
+            return self.fixture(f'fci_{ticker}.html')
+        return self.fixture('fci_fund_data.html')
+
+    def yahoo_spark(self, tickers):
+        """Return a 5 day Yahoo spark response for several tickers in one body.
+
+        Tickers recorded in yahoo_spark.json by grabar are answered with their captured chart; the rest
+        get a synthetic one with a deterministic price per ticker.
+        """
+        grabados = {}
+        if (self.fixtures / 'yahoo_spark.json').exists():
+            grabados = {r['symbol']: r for r in json.loads(self.fixture('yahoo_spark.json'))['spark']['result']}
+
+        hoy = dt.datetime.combine(dt.date.today(), dt.time(20))
+        dias = [hoy - dt.timedelta(days=d) for d in range(5, 0, -1)]
+        resultados = []
+        for ticker in tickers:
+            if ticker in grabados:
+                resultados.append(grabados[ticker])
+                continue
+            base = 100 + sum(map(ord, ticker)) % 900
+            resultados.append({'symbol': ticker, 'response': [{
+                'meta': {'symbol': ticker},
+                'timestamp': [int(dia.timestamp()) for dia in dias],
+                'indicators': {'quote': [{'close': [round(base * (1 + i / 100), 2) for i in range(len(dias))]}]}
+            }]})
+        return json.dumps({'spark': {'result': resultados, 'error': None}}).encode()
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+
+def grabar(tickers, acciones=(), fixtures=FIXTURES):
+    """Capture the live FCI pages, bluelytics rate and Yahoo quotes into the fixtures directory.
+
+    Args:
+        tickers (list): The FCI tickers to record.
+        acciones (list): The stock/CEDEAR tickers to record from the Yahoo spark endpoint. Optional.
+        fixtures (Path): The directory to write the captures to.
+
+    Returns:
+        None
+    """
+    fixtures = Path(fixtures)
+    with requests.Session() as sesion:
+        for ticker in tickers:
+            res = sesion.get(FCI_URL.format(ticker=ticker), timeout=30)
+            res.raise_for_status()
+            (fixtures / f'fci_{ticker}.html').write_bytes(res.content)
+            print(f"fci_{ticker}.html")
+
+        res = sesion.get(USD_URL, timeout=30)
+        res.raise_for_status()
+        (fixtures / 'bluelytics_latest.json').write_bytes(res.content)
+        print("bluelytics_latest.json")
+
+        if acciones:
+            res = sesion.get(YAHOO_SPARK_URL, params={'symbols': ','.join(acciones), 'range': '5d', 'interval': '1d'},
+                             headers={'User-Agent': 'Mozilla/5.0'}, timeout=30)
+            res.raise_for_status()
+            (fixtures / 'yahoo_spark.json').write_bytes(res.content)
+            print("yahoo_spark.json")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest='comando', required=True)
+
+    servir = sub.add_parser('servir')
+    servir.add_argument('--puerto', type=int, default=8765)
+    servir.add_argument('--latencia', type=float, default=0.0, help='milisegundos por request')
+    servir.add_argument('--errores', type=float, default=0.0, help='fraccion de requests con 503')
+
+    grabar_cmd = sub.add_parser('grabar')
+    grabar_cmd.add_argument('tickers', nargs='+')
+    grabar_cmd.add_argument('--acciones', nargs='+', default=[])
+
+    args = parser.parse_args()
+    if args.comando == 'grabar':
+        grabar(args.tickers, args.acciones)
+        return
+
+    server = ReplayServer(puerto=args.puerto, latencia=args.latencia / 1000, errores=args.errores)
+    print(f"ST_FCI_URL={server.fci_url}")
+    print(f"ST_USD_URL={server.usd_url}")
+    print(f"ST_TELEGRAM_URL={server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+        sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
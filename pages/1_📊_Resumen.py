@@ -1,9 +1,14 @@
-from utils.db_conn import conexionDB, custom_query_resume
-from utils.st_def import mostrar_resumen_categoria, generar_espacios, categoria_label_concat_def, st
-from utils.functions import actualizar, appendear_historical
-from utils.df_def import last_usd_total, last_cat_ev_summ, last_cat_ev_summ_cat, hist_day_summary, agrupado_ticker_resumen, hist_day_cat_summary, last_ticker_summ
+import datetime as dt
+import pandas as pd
+from utils.db_conn import custom_query_resume_futuros, custom_query_hist_page, custom_query_resumen_diario, cacheado, version_datos
+from utils.st_def import mostrar_resumen_categoria, mostrar_progreso_actualizacion, generar_espacios, categoria_label_concat_def, st
+from utils.refresh_jobs import lanzar_actualizacion
+from utils.df_def import PortfolioFrames, agrupado_ticker_resumen, tipar_historial
 import plotly.graph_objects as go
 
+# dias de historia cargados al abrir la pagina y por cada pagina anterior
+DIAS_HIST = 90
+
 #  page config
 st.set_page_config(page_title="Resumen", page_icon=":bar_chart:", layout="wide", initial_sidebar_state="collapsed")
 
@@ -22,25 +27,42 @@ st.markdown(
 # seteo de parametros barra lateral
 st.sidebar.header('Parametros')
 value = 10 if st.sidebar.toggle('//') else 1
-table_suf = "_jes" if st.sidebar.toggle('Jes') else ("_mama" if st.sidebar.toggle('Mama') else "")
+portfolio = None if st.sidebar.toggle('Todos') else ("jes" if st.sidebar.toggle('Jes') else ("mama" if st.sidebar.toggle('Mama') else "principal"))
 
 # DFs generation
 # ---------------------------------------------------------------------------------------------------------------
 # ---------------------------------------------------------------------------------------------------------------
-df_hist, df_last = custom_query_resume(divider=value, table_suf=table_suf)
+desde = dt.date.today() - dt.timedelta(days=DIAS_HIST)
+# version de los datos leida antes que ellos, para cachear las transformaciones hasta la proxima escritura
+version = version_datos()
+# df_hist y df_last se leen a la vez; el encabezado se dibuja con df_last mientras carga la historia
+futuro_hist, futuro_last = custom_query_resume_futuros(divider=value, portfolio=portfolio, desde=desde)
+
+# historia anterior a pedido, paginada hacia atras desde el inicio de la ventana
+hist_anterior = st.session_state.setdefault(f'hist_anterior_{portfolio}_{value}_{desde}', {'paginas': [], 'cursor': str(desde)})
+if st.sidebar.button('Historia anterior', disabled=hist_anterior['cursor'] is None):
+    pagina, hist_anterior['cursor'] = custom_query_hist_page(divider=value, portfolio=portfolio, antes=hist_anterior['cursor'], dias=DIAS_HIST)
+    hist_anterior['paginas'].append(pagina)
+fechas_anteriores = [pagina['fecha_upd'].min().date() for pagina in hist_anterior['paginas'] if not pagina.empty]
+
+# totales diarios de las tablas de resumen, para la misma ventana que df_hist
+df_hist_day_summ, df_hist_day_cat_summ = custom_query_resumen_diario(divider=value, portfolio=portfolio,
+                                                                     desde=min(fechas_anteriores, default=desde))
+df_last = futuro_last.result()
 # ---------------------------------------------------------------------------------------------------------------
 # ---------------------------------------------------------------------------------------------------------------
 
 # DFs transformations
 # ---------------------------------------------------------------------------------------------------------------
 # ---------------------------------------------------------------------------------------------------------------
-df_last_usd_total = last_usd_total(df_last=df_last)
-df_last_cat_ev_summ = last_cat_ev_summ(df_last=df_last, df_hist=df_hist)
-df_last_cat_ev_summ_cat = last_cat_ev_summ_cat(df_last=df_last, df_hist=df_hist)
-df_hist_day_summ = hist_day_summary(df_hist=df_hist)
-df_agrupado_ticker_resumen = agrupado_ticker_resumen(df_hist=df_hist)
-df_hist_day_cat_summ = hist_day_cat_summary(df_hist=df_hist)
-df_last_ticker_summ = last_ticker_summ(df_last=df_last)
+# con los totales diarios precalculados no hace falta df_hist; las agrupaciones comunes se calculan una vez
+frames = cacheado(('PortfolioFrames', portfolio, value, desde, len(hist_anterior['paginas'])),
+                  lambda: PortfolioFrames(df_last=df_last, df_hist_day_summ=df_hist_day_summ, df_hist_day_cat_summ=df_hist_day_cat_summ),
+                  version=version)
+df_last_usd_total = frames.last_usd_total
+df_last_cat_ev_summ = frames.last_cat_ev_summ
+df_last_cat_ev_summ_cat = frames.last_cat_ev_summ_cat
+df_last_ticker_summ = frames.last_ticker_summ
 # ---------------------------------------------------------------------------------------------------------------
 # ---------------------------------------------------------------------------------------------------------------
 
@@ -76,22 +98,29 @@ with col1:
         except Exception as e:
             # print(e)
             pass
-    with cole:
-        try:
-            df_agrupado_ticker_resumen_categoria = df_agrupado_ticker_resumen[df_agrupado_ticker_resumen['categoria'].str.contains('USD')]
-            st.metric(label="USD", value=f"${df_agrupado_ticker_resumen_categoria['valor_actual_last'].iloc[0]}", delta=f"{df_last_cat_ev_summ_cat['porcentaje_diferencia'][3].split('%')[0]}%")
-        except Exception as e:
-            # print(e)
-            pass
 
 with col2:
     st.header(f"""*:grey[{df_last['fecha_upd'][0]}]*""")
     if st.button('Actualizar', type="primary", use_container_width=True):
-        conexion = conexionDB()
-        actualizar(conexion=conexion)
-        appendear_historical(conexion=conexion)
-        conexion.cerrar()
-        st.rerun()
+        st.session_state['refresh_job'] = lanzar_actualizacion()
+    if 'refresh_job' in st.session_state:
+        mostrar_progreso_actualizacion()
+
+# historia, leida en paralelo con df_last
+df_hist = futuro_hist.result()
+if hist_anterior['paginas']:
+    df_hist = tipar_historial(pd.concat([df_hist] + hist_anterior['paginas'], ignore_index=True))
+# con su propia clave: frames es compartido por todas las sesiones y no se modifica
+df_agrupado_ticker_resumen = cacheado(('agrupado_ticker_resumen', portfolio, value, desde, len(hist_anterior['paginas'])),
+                                      lambda: agrupado_ticker_resumen(df_hist), version=version)
+
+with cole:
+    try:
+        df_agrupado_ticker_resumen_categoria = df_agrupado_ticker_resumen[df_agrupado_ticker_resumen['categoria'].str.contains('USD')]
+        st.metric(label="USD", value=f"${df_agrupado_ticker_resumen_categoria['valor_actual_last'].iloc[0]}", delta=f"{df_last_cat_ev_summ_cat['porcentaje_diferencia'][3].split('%')[0]}%")
+    except Exception as e:
+        # print(e)
+        pass
 
 #  dinamic tabs
 tab_list = [tab for tab in st.tabs(['Total'] + [cat.split('. ')[1] for cat in df_last_cat_ev_summ_cat['categoria'].tolist()])]
@@ -1,6 +1,8 @@
 from utils.db_conn import conexionDB, custom_query_resume
 from utils.st_def import st
-from utils.functions import guardar, editar, eliminar, Registro
+from utils.functions import guardar, guardar_lote, editar, eliminar, Registro
+from utils.df_def import CATEGORIAS, validar_lote
+import pandas as pd
 import time
 from datetime import datetime
 
@@ -23,8 +25,8 @@ st.markdown(
 # sidebar parameters
 st.sidebar.header('Parametros')
 value = 10 if st.sidebar.toggle('//') else 1
-table_suf = "_jes" if st.sidebar.toggle('Jes') else ("_mama" if st.sidebar.toggle('Mama') else "")
-df_hist, df_last = custom_query_resume(divider=value, table_suf=table_suf)
+portfolio = "jes" if st.sidebar.toggle('Jes') else ("mama" if st.sidebar.toggle('Mama') else "principal")
+df_hist, df_last = custom_query_resume(divider=value, portfolio=portfolio)
 
 # page config
 col1, col2 = st.columns([4, 1])
@@ -118,7 +120,7 @@ with col2:
 
 with col1:
     fecha_compra = st.date_input("Fecha de compra", value=fecha_compra_s)
-    categoria = st.selectbox("Categoria", ("1. FCI", "2. Cedear", "3. Accion", "4. USD"),
+    categoria = st.selectbox("Categoria", CATEGORIAS,
                              index=categoria_s,
                              placeholder="Selec instrument..."
                              )
@@ -135,11 +137,11 @@ with col1:
                 cantidad,
                 monto
             )
-            conexion = conexionDB().conexion
-            guardar(registro, conexion)
+            conexion = conexionDB()
+            guardar(registro, conexion, portfolio)
             st.toast('Cargando registro... ⏳ ⌛', icon='🥳')
             time.sleep(3)
-            conexion.close()
+            conexion.cerrar()
             st.rerun()
         else:
             st.warning("Registro incompleto..", icon="⚠️")
@@ -154,22 +156,88 @@ with col1:
                 monto
             )
         if id_registro_s:
-            conexion = conexionDB().conexion
-            editar(registro, conexion, id_registro_s)
+            conexion = conexionDB()
+            editar(registro, conexion, id_registro_s, portfolio)
             st.toast('Editando registro... ⏳ ⌛', icon='😬')
             time.sleep(3)
-            conexion.close()
+            conexion.cerrar()
             st.rerun()
         else:
             st.warning("No se selecciono registro! Seleccione uno..", icon="⚠️")
 
     if st.button('Eliminar', type="primary", use_container_width=True):
         if id_registro_s:
-            conexion = conexionDB().conexion
-            eliminar(id_registro_s, conexion)
+            conexion = conexionDB()
+            eliminar(id_registro_s, conexion, portfolio)
             st.toast('Eliminando registro... ⏳ ⌛', icon='😤')
             time.sleep(3)
-            conexion.close()
+            conexion.cerrar()
             st.rerun()
         else:
             st.warning("No se selecciono registro! Seleccione uno..", icon="⚠️")
+
+
+# bulk import
+CAMPOS_LOTE = {
+    'fecha_compra': ['fecha_compra', 'fecha', 'fecha de compra', 'date', 'fecha operacion', 'fecha concertacion'],
+    'categoria': ['categoria', 'tipo', 'instrumento', 'clase', 'type'],
+    'ticker': ['ticker', 'especie', 'simbolo', 'symbol', 'codigo'],
+    'cantidad': ['cantidad', 'cant', 'nominales', 'cuotapartes', 'quantity'],
+    'monto': ['monto', 'importe', 'total', 'monto neto', 'amount'],
+}
+SIN_COLUMNA = '(ninguna)'
+
+with st.expander('Importar CSV'):
+    # The records left out by the last import, shown after its rerun.
+    for ticker_f, error in st.session_state.pop('importacion_fallidos', []):
+        st.warning(f"No importado {ticker_f}: {error}", icon="⚠️")
+
+    clave_archivo = f"importar_csv_{st.session_state.get('importaciones', 0)}"
+    archivo = st.file_uploader("Archivo del broker", type=['csv', 'txt'], key=clave_archivo)
+    if archivo is not None:
+        try:
+            df_csv = pd.read_csv(archivo, sep=None, engine='python', dtype=str)
+        except Exception as e:
+            print(f"Error lectura csv: {e}")
+            st.error(f"No se pudo leer el archivo: {e}", icon="🚨")
+            df_csv = None
+
+    if archivo is not None and df_csv is not None:
+        columnas = [SIN_COLUMNA] + list(df_csv.columns)
+        normalizadas = {str(c).strip().lower(): c for c in df_csv.columns}
+        mapeo = {}
+        cols = st.columns(len(CAMPOS_LOTE))
+        for col, (campo, sinonimos) in zip(cols, CAMPOS_LOTE.items()):
+            sugerida = next((normalizadas[s] for s in sinonimos if s in normalizadas), SIN_COLUMNA)
+            with col:
+                mapeo[campo] = st.selectbox(campo, columnas, index=columnas.index(sugerida), key=f'{clave_archivo}_{campo}')
+
+        # Without a category column, every row gets the category chosen here.
+        categoria_fija = None
+        if mapeo['categoria'] == SIN_COLUMNA:
+            categoria_fija = st.selectbox("Categoria para todas las filas", CATEGORIAS, key=f'{clave_archivo}_categoria_fija')
+
+        # The broker's number format, so that '1.500' is not read as 1.5 or 1500 by guessing.
+        decimal = st.radio("Separador decimal", [',', '.'], horizontal=True, key=f'{clave_archivo}_decimal',
+                           format_func=lambda d: {',': 'Coma (1.234,56)', '.': 'Punto (1,234.56)'}[d])
+
+        df_mapeado = pd.DataFrame({campo: df_csv[columna] if columna != SIN_COLUMNA else None
+                                   for campo, columna in mapeo.items()})
+        if categoria_fija is not None:
+            df_mapeado['categoria'] = categoria_fija
+        validos, df_errores = validar_lote(df_mapeado, decimal)
+
+        st.write(f"{len(validos)} registros validos, {len(df_errores)} con errores")
+        if len(df_errores):
+            st.dataframe(df_errores, hide_index=True, use_container_width=True)
+        st.dataframe(validos, hide_index=True, use_container_width=True)
+
+        if st.button('Importar', type="primary", use_container_width=True, disabled=validos.empty):
+            conexion = conexionDB()
+            insertados, fallidos = guardar_lote(validos, conexion, portfolio)
+            conexion.cerrar()
+            st.session_state['importacion_fallidos'] = fallidos
+            st.toast(f'{insertados} registros importados', icon='🥳')
+            st.session_state['importaciones'] = st.session_state.get('importaciones', 0) + 1
+            time.sleep(3)
+            st.rerun()
@@ -1,4 +1,4 @@
-from utils.db_conn import custom_query_inf
+from utils.db_conn import custom_query_inf, cacheado, version_datos
 from utils.st_def import generar_espacios, st
 from utils.df_def import inf_mensual, inf_interanual, inf_acumulado
 import plotly.graph_objects as go
@@ -23,6 +23,7 @@ st.markdown(
 # DFs generation
 # ---------------------------------------------------------------------------------------------------------------
 # ---------------------------------------------------------------------------------------------------------------
+version = version_datos()
 df_inf = custom_query_inf()
 # ---------------------------------------------------------------------------------------------------------------
 # ---------------------------------------------------------------------------------------------------------------
@@ -30,9 +31,13 @@ df_inf = custom_query_inf()
 # DFs transformations
 # ---------------------------------------------------------------------------------------------------------------
 # ---------------------------------------------------------------------------------------------------------------
-df_inf_men = inf_mensual(df=df_inf)
-df_inf_men_iter = inf_interanual(df=df_inf_men)
-df_inf_men_iter_acum = inf_acumulado(df=df_inf_men_iter)
+def transformar_inf():
+    df_inf_men = inf_mensual(df=df_inf)
+    df_inf_men_iter = inf_interanual(df=df_inf_men)
+    return df_inf_men, df_inf_men_iter, inf_acumulado(df=df_inf_men_iter)
+
+
+df_inf_men, df_inf_men_iter, df_inf_men_iter_acum = cacheado(('inflacion',), transformar_inf, version=version)
 # ---------------------------------------------------------------------------------------------------------------
 # ---------------------------------------------------------------------------------------------------------------
 
@@ -1,15 +1,225 @@
+import datetime as dt
+import os
+import queue
 import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 try:
-    from df_def import execute_queries_df_last, execute_queries_df_hist, execute_queries_df_inf
+    from df_def import execute_queries_df_last, execute_queries_df_hist, execute_queries_df_inf, execute_queries_df_summary
+    from migrations import migrar
+    from hist_arrow import cargar_historial
 except:
-    from utils.df_def import execute_queries_df_last, execute_queries_df_hist, execute_queries_df_inf
+    from utils.df_def import execute_queries_df_last, execute_queries_df_hist, execute_queries_df_inf, execute_queries_df_summary
+    from utils.migrations import migrar
+    from utils.hist_arrow import cargar_historial
+
+
+BASE_DATOS = os.environ.get('ST_DB_PATH', r'F:\Otros\Codigos importantes\Fede - mio\Finance_inverions\finance\database\finances_invertions.db')
+
+# PRAGMAs applied to every new connection. WAL lets the dashboard read while a refresh writes.
+PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA busy_timeout=5000',
+    'PRAGMA mmap_size=268435456',
+    'PRAGMA cache_size=-65536',
+    'PRAGMA temp_store=MEMORY',
+)
+
+# Idle connections kept open per database.
+TAMANO_POOL = int(os.environ.get('ST_DB_POOL', 4))
+
+# Entries kept by the cache of query results and derived frames, the least recently used evicted first.
+TAMANO_CACHE = int(os.environ.get('ST_CACHE_ENTRADAS', 32))
+
+# First snapshot date read by custom_query_resume when no range is given.
+HIST_DESDE = os.environ.get('ST_HIST_DESDE', '2023-03-23')
+
+# Threads running the reads of custom_query_resume_futuros, each on its own pooled connection.
+_lectores = ThreadPoolExecutor(max_workers=TAMANO_POOL, thread_name_prefix='lectura')
+
+
+class PoolConexiones:
+    """Process-wide pool of SQLite connections to one database.
+
+    Connections are opened once with PRAGMAS applied and reused across Streamlit reruns, refresh
+    jobs and threads; each one is used by a single borrower at a time. Up to 'tamano' idle
+    connections are kept, and a connection closed by its borrower is discarded.
+
+    Attributes:
+        base_datos: A string representing the file path of the SQLite database.
+        tamano: The maximum number of idle connections kept.
+    """
+
+    def __init__(self, base_datos, tamano=TAMANO_POOL):
+        """Initialize an empty pool."""
+        self.base_datos = base_datos
+        self.tamano = tamano
+        self.libres = queue.LifoQueue()
+        self._centinela = None
+        self._centinela_lock = threading.Lock()
+
+    def _abrir(self):
+        """Open a new connection with the pool PRAGMAs."""
+        conexion = sqlite3.connect(self.base_datos, check_same_thread=False)
+        for pragma in PRAGMAS:
+            conexion.execute(pragma)
+        return conexion
+
+    def obtener(self):
+        """Borrow an open connection from the pool, opening one if none is idle."""
+        while True:
+            try:
+                conexion = self.libres.get_nowait()
+            except queue.Empty:
+                return self._abrir()
+            try:
+                conexion.total_changes
+                return conexion
+            except sqlite3.ProgrammingError:
+                continue
+
+    def version(self):
+        """Return a token of the database contents, which changes with every commit.
+
+        The token is PRAGMA data_version of a connection kept open only for it. That connection
+        never writes, so its value changes whenever any other one, of this process or another,
+        commits. Reading it touches no table.
+        """
+        with self._centinela_lock:
+            if self._centinela is None:
+                self._centinela = sqlite3.connect(self.base_datos, check_same_thread=False)
+            return self._centinela.execute('PRAGMA data_version').fetchone()[0]
+
+    def devolver(self, conexion):
+        """Give a connection back to the pool, rolling back anything left uncommitted."""
+        try:
+            conexion.rollback()
+        except sqlite3.ProgrammingError:
+            return
+        if self.libres.qsize() < self.tamano:
+            self.libres.put(conexion)
+        else:
+            conexion.close()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def obtener_pool(base_datos=None):
+    """Return the connection pool of a database.
+
+    The first time a database is used in the process its pending migrations are applied.
+
+    Args:
+        base_datos (str): The file path of the SQLite database. Defaults to BASE_DATOS.
+
+    Returns:
+        PoolConexiones: The process-wide pool of the database.
+    """
+    base_datos = base_datos or BASE_DATOS
+    with _pools_lock:
+        if base_datos not in _pools:
+            pool = PoolConexiones(base_datos)
+            conexion = pool.obtener()
+            migrar(conexion)
+            pool.devolver(conexion)
+            _pools[base_datos] = pool
+        return _pools[base_datos]
+
+
+class CacheVersionado:
+    """LRU cache of values computed from a database, each valid while the database is unchanged.
+
+    Every value is stored with the PoolConexiones.version token read before computing it, and a
+    lookup with any other token misses. A key holds a single entry, replaced when recomputed.
+
+    Attributes:
+        tamano: The maximum number of entries kept.
+        aciertos: Number of lookups answered from the cache.
+        fallos: Number of lookups that had to compute their value.
+    """
+
+    def __init__(self, tamano=TAMANO_CACHE):
+        """Initialize an empty cache."""
+        self.tamano = tamano
+        self.entradas = OrderedDict()
+        self.lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def buscar(self, clave, version):
+        """Return the value of a key computed at a version, or None if there is none."""
+        with self.lock:
+            entrada = self.entradas.get(clave)
+            if entrada is None or entrada[0] != version:
+                self.fallos += 1
+                return None
+            self.entradas.move_to_end(clave)
+            self.aciertos += 1
+            return entrada[1]
+
+    def guardar(self, clave, version, valor):
+        """Store the value of a key computed at a version, evicting the least recently used entries."""
+        with self.lock:
+            self.entradas[clave] = (version, valor)
+            self.entradas.move_to_end(clave)
+            while len(self.entradas) > self.tamano:
+                self.entradas.popitem(last=False)
+
+    def obtener(self, clave, version, calcular):
+        """Return the value of a key at a version, computing and storing it with calcular() on a miss."""
+        valor = self.buscar(clave, version)
+        if valor is None:
+            valor = calcular()
+            self.guardar(clave, version, valor)
+        return valor
+
+
+_cache = CacheVersionado()
+
+
+def version_datos(base_datos=None):
+    """Return the token of the contents of a database (see PoolConexiones.version).
+
+    Args:
+        base_datos (str): The file path of the SQLite database. Defaults to BASE_DATOS.
+
+    Returns:
+        int: A value that changes whenever the database is written.
+    """
+    return obtener_pool(base_datos).version()
+
+
+def cacheado(clave, calcular, version=None):
+    """Return a value derived from the database, recomputed only when the database changed.
+
+    Meant for the query results and the frames derived from them, which are recomputed on every
+    Streamlit rerun otherwise. The values are shared between reruns and sessions, so callers
+    must not modify them in place.
+
+    Args:
+        clave (tuple): The key of the value, with every argument it depends on.
+        calcular (callable): Computes the value, called without arguments on a miss.
+        version (int, optional): The version_datos token read before the data the value derives
+            from. Defaults to the current one.
+
+    Returns:
+        The cached or newly computed value.
+    """
+    if version is None:
+        version = version_datos()
+    return _cache.obtener((BASE_DATOS,) + tuple(clave), version, calcular)
 
 
 class conexionDB:
     """Database Connection Class.
 
     This class represents a connection to the SQLite database used in the finance application.
-    It initializes the connection to the database and provides a method to close the connection.
+    The connection is borrowed from the process-wide PoolConexiones of the database and given
+    back when it is closed.
 
     Attributes:
         base_datos: A string representing the file path of the SQLite database.
@@ -17,37 +227,52 @@ class conexionDB:
         cursor: A cursor object used to execute SQL queries.
 
     Methods:
-        cerrar: Closes the database connection and commits any pending transactions.
+        cerrar: Commits any pending transactions and gives the connection back to the pool.
     """
-    def __init__(self):
-        """Initialize the database connection."""
-        self.base_datos = r'F:\Otros\Codigos importantes\Fede - mio\Finance_inverions\finance\database\finances_invertions.db'
-        self.conexion = sqlite3.connect(self.base_datos)
+    def __init__(self, base_datos=None):
+        """Initialize the database connection.
+
+        Args:
+            base_datos (str): The file path of the SQLite database. Defaults to BASE_DATOS, read
+                from the ST_DB_PATH environment variable.
+        """
+        self.base_datos = base_datos or BASE_DATOS
+        self.conexion = obtener_pool(self.base_datos).obtener()
         self.cursor = self.conexion.cursor()
 
     def cerrar(self):
         """Close the database connection."""
         self.conexion.commit()
-        self.conexion.close()
+        obtener_pool(self.base_datos).devolver(self.conexion)
 
 
-def custom_query_resume(divider, table_suf):
-    """Execute custom queries and retrieve summarized financial data.
+def _fecha_sql(fecha):
+    """Return a date, datetime or 'YYYY-MM-DD' string as the string stored in fecha_upd."""
+    if isinstance(fecha, dt.datetime):
+        fecha = fecha.date()
+    return str(fecha)
 
-    This function executes custom SQL queries on the historical and current financial data
-    tables to retrieve summarized financial information. It calculates the quantity and amount
-    by dividing the original values by the provided divider. The retrieved data is sorted by
-    update date and record ID in descending order.
 
-    Args:
-        divider (int): A number to divide the quantity and amount for summarization.
-        table_suf (str): A suffix to be appended to the table names for custom querying.
+def _rango_fechas(desde=None, hasta=None):
+    """Return the [desde, hasta + 1 day) bounds compared against fecha_upd.
 
-    Returns:
-        DataFrame: A DataFrame containing summarized historical financial data.
-        DataFrame: A DataFrame containing summarized current financial data.
+    Both ends are inclusive days; hasta=None leaves the range open to the latest snapshot.
     """
-    sql_hist = f'''
+    desde = _fecha_sql(desde or HIST_DESDE)
+    if hasta is None:
+        return desde, '9999-12-31'
+    hasta = dt.date.fromisoformat(_fecha_sql(hasta)[:10]) + dt.timedelta(days=1)
+    return desde, str(hasta)
+
+
+def _filtro_portfolio(portfolio):
+    """Return the WHERE condition selecting a portfolio, or every portfolio if it is None."""
+    return '1' if portfolio is None else 'portfolio = :portfolio'
+
+
+def _sql_hist(divider, portfolio, where):
+    """Return the history query of a portfolio filtered by a WHERE clause on fecha_upd."""
+    return f'''
         SELECT id_registro,
         fecha_compra,
         categoria,
@@ -56,10 +281,14 @@ def custom_query_resume(divider, table_suf):
         monto / {divider} AS monto,
         valor_actual,
         fecha_upd
-        FROM historical_finance_invertions{table_suf}
-        WHERE strftime('%Y-%m-%d', fecha_upd) > '2023-03-22'
+        FROM historical_holdings
+        WHERE {_filtro_portfolio(portfolio)} AND {where}
         ORDER BY fecha_upd desc, id_registro desc
     '''
+
+
+def _leer_last(divider, portfolio):
+    """Read the current records of a portfolio on a connection of its own."""
     sql_last = f'''
         SELECT id_registro,
         fecha_compra,
@@ -69,18 +298,194 @@ def custom_query_resume(divider, table_suf):
         monto / {divider} AS monto,
         valor_actual,
         fecha_upd
-        FROM finance{table_suf}
+        FROM holdings
+        WHERE {_filtro_portfolio(portfolio)}
         ORDER BY fecha_upd desc, id_registro desc
     '''
+    conexion = conexionDB()
+    try:
+        return execute_queries_df_last(sql_last=sql_last, conexion=conexion.conexion, params={'portfolio': portfolio})
+    finally:
+        conexion.cerrar()
 
-    conexion = conexionDB().conexion
 
-    df_last = execute_queries_df_last(sql_last=sql_last, conexion=conexion)
-    df_hist = execute_queries_df_hist(sql_hist=sql_hist, conexion=conexion)
+def _leer_hist(divider, portfolio, desde, hasta):
+    """Read the history of a portfolio between two fecha_upd bounds on a connection of its own."""
+    conexion = conexionDB()
+    try:
+        df_hist = cargar_historial(conexion, divider, portfolio=portfolio, desde=desde, hasta=hasta)
+        if df_hist is None:
+            sql_hist = _sql_hist(divider, portfolio, 'fecha_upd >= :desde AND fecha_upd < :hasta')
+            df_hist = execute_queries_df_hist(sql_hist=sql_hist, conexion=conexion.conexion,
+                                              params={'portfolio': portfolio, 'desde': desde, 'hasta': hasta})
+        return df_hist
+    finally:
+        conexion.cerrar()
 
-    conexion.close()
 
-    return df_hist, df_last
+def _guardar_al_terminar(clave, version):
+    """Return a future callback that stores its result in the cache, unless the read failed."""
+    def guardar(futuro):
+        if futuro.exception() is None:
+            _cache.guardar(clave, version, futuro.result())
+    return guardar
+
+
+def custom_query_resume_futuros(divider, portfolio='principal', desde=None, hasta=None):
+    """Start the reads of custom_query_resume concurrently and return them as futures.
+
+    The current records and the history are read at the same time, each on its own pooled
+    connection, so the caller can use df_last, which is small, while the history is still loading.
+    Frames read since the last write to the database are returned from the cache as completed
+    futures, without any read.
+
+    Args:
+        divider (int): A number to divide the quantity and amount for summarization.
+        portfolio (str): The portfolio key, or None for the records of every portfolio together.
+        desde (date or str, optional): First snapshot day included. Defaults to HIST_DESDE.
+        hasta (date or str, optional): Last snapshot day included. Defaults to the latest one.
+
+    Returns:
+        Future: The future of the df_hist of custom_query_resume.
+        Future: The future of the df_last of custom_query_resume.
+    """
+    desde, hasta = _rango_fechas(desde, hasta)
+    version = version_datos()
+
+    futuros = []
+    for leer, args in ((_leer_hist, (divider, portfolio, desde, hasta)), (_leer_last, (divider, portfolio))):
+        clave = (BASE_DATOS, leer.__name__) + args
+        df = _cache.buscar(clave, version)
+        if df is None:
+            futuro = _lectores.submit(leer, *args)
+            futuro.add_done_callback(_guardar_al_terminar(clave, version))
+        else:
+            futuro = Future()
+            futuro.set_result(df)
+        futuros.append(futuro)
+    return tuple(futuros)
+
+
+def custom_query_resume(divider, portfolio='principal', desde=None, hasta=None):
+    """Execute custom queries and retrieve summarized financial data.
+
+    This function executes custom SQL queries on the historical and current financial data
+    tables to retrieve summarized financial information. It calculates the quantity and amount
+    by dividing the original values by the provided divider. The retrieved data is sorted by
+    update date and record ID in descending order.
+
+    The history is limited to the snapshots between 'desde' and 'hasta' with a plain range on
+    fecha_upd, so it is read through the (portfolio, fecha_upd, id_registro) index instead of a
+    full scan. When the Arrow copy of the history written by hist_arrow.exportar_historial is
+    current it is memory-mapped instead, and SQLite is only read if it is missing or stale.
+    Both reads run concurrently, and are cached, through custom_query_resume_futuros.
+
+    Args:
+        divider (int): A number to divide the quantity and amount for summarization.
+        portfolio (str): The portfolio key, or None for the records of every portfolio together.
+        desde (date or str, optional): First snapshot day included. Defaults to HIST_DESDE.
+        hasta (date or str, optional): Last snapshot day included. Defaults to the latest one.
+
+    Returns:
+        DataFrame: A DataFrame containing summarized historical financial data.
+        DataFrame: A DataFrame containing summarized current financial data.
+    """
+    futuro_hist, futuro_last = custom_query_resume_futuros(divider, portfolio=portfolio, desde=desde, hasta=hasta)
+    return futuro_hist.result(), futuro_last.result()
+
+
+def custom_query_hist_page(divider, portfolio='principal', antes=None, dias=90):
+    """Retrieve one page of the summarized history, going back in time.
+
+    Pages are keyset-paginated on fecha_upd: each one holds the whole snapshots of the 'dias'
+    update dates before 'antes', so a daily total is never split across two pages and fetching
+    an old page costs the same as a recent one. Pass the returned cursor as 'antes' to get the
+    next, older page. Pages are cached until the database changes.
+
+    Args:
+        divider (int): A number to divide the quantity and amount for summarization.
+        portfolio (str): The portfolio key, or None for the records of every portfolio together.
+        antes (date or str, optional): Exclusive upper bound of the page. Defaults to the latest snapshot.
+        dias (int): Number of snapshot dates per page.
+
+    Returns:
+        DataFrame: A DataFrame with the history of the page, like the one of custom_query_resume.
+        str: The cursor of the next page, or None if there is no older history.
+    """
+    sql_hist = _sql_hist(divider, portfolio, f'''fecha_upd < :antes AND fecha_upd >= (
+            SELECT MIN(fecha_upd) FROM (
+                SELECT DISTINCT fecha_upd FROM historical_holdings
+                WHERE {_filtro_portfolio(portfolio)} AND fecha_upd < :antes
+                ORDER BY fecha_upd desc
+                LIMIT :dias))''')
+
+    antes = _fecha_sql(antes or '9999-12-31')
+
+    def leer():
+        conexion = conexionDB()
+        df_hist = execute_queries_df_hist(sql_hist=sql_hist, conexion=conexion.conexion,
+                                          params={'portfolio': portfolio, 'antes': antes, 'dias': dias})
+        conexion.cerrar()
+
+        if df_hist.empty or df_hist['fecha_upd'].nunique() < dias:
+            return df_hist, None
+        return df_hist, _fecha_sql(df_hist['fecha_upd'].min())
+
+    return cacheado(('custom_query_hist_page', divider, portfolio, antes, dias), leer)
+
+
+def custom_query_resumen_diario(divider, portfolio='principal', desde=None, hasta=None):
+    """Retrieve the daily totals of a portfolio from the daily rollup tables.
+
+    The totals are read from daily_portfolio_summary and daily_category_summary, which
+    appendear_historical maintains, instead of aggregating the history in pandas. The frames
+    have the layout of df_def.hist_day_summary and df_def.hist_day_cat_summary, and are cached
+    until the database changes.
+
+    Args:
+        divider (int): A number to divide the amounts for summarization.
+        portfolio (str): The portfolio key, or None for the totals of every portfolio together.
+        desde (date or str, optional): First day included. Defaults to HIST_DESDE.
+        hasta (date or str, optional): Last day included. Defaults to the latest one.
+
+    Returns:
+        DataFrame: A DataFrame with 'fecha_upd', 'monto' and 'monto_actual' per day.
+        DataFrame: A DataFrame with 'categoria', 'fecha_upd', 'monto_actual' and 'monto' per category and day.
+    """
+    sql_day = f'''
+        SELECT fecha_upd,
+        SUM(monto) / {divider} AS monto,
+        SUM(monto_actual) / {divider} AS monto_actual
+        FROM daily_portfolio_summary
+        WHERE {_filtro_portfolio(portfolio)} AND fecha_upd >= :desde AND fecha_upd < :hasta
+        GROUP BY fecha_upd
+        ORDER BY fecha_upd
+    '''
+    # hist_day_cat_summary names the sum of monto 'monto_actual' and the sum of monto_actual 'monto'.
+    sql_day_cat = f'''
+        SELECT categoria,
+        fecha_upd,
+        SUM(monto) / {divider} AS monto_actual,
+        SUM(monto_actual) / {divider} AS monto
+        FROM daily_category_summary
+        WHERE {_filtro_portfolio(portfolio)} AND fecha_upd >= :desde AND fecha_upd < :hasta
+        GROUP BY categoria, fecha_upd
+        ORDER BY categoria, fecha_upd
+    '''
+    desde, hasta = _rango_fechas(desde, hasta)
+    params = {'portfolio': portfolio, 'desde': desde, 'hasta': hasta}
+
+    def leer():
+        conexion = conexionDB()
+
+        df_hist_day_summ = execute_queries_df_summary(sql=sql_day, conexion=conexion.conexion, params=params)
+        df_hist_day_cat_summ = execute_queries_df_summary(sql=sql_day_cat, conexion=conexion.conexion, params=params)
+
+        conexion.cerrar()
+
+        return df_hist_day_summ, df_hist_day_cat_summ
+
+    return cacheado(('custom_query_resumen_diario', divider, portfolio, desde, hasta), leer)
 
 
 def custom_query_inf():
@@ -88,7 +493,8 @@ def custom_query_inf():
 
     This function executes a custom SQL query to retrieve inflation data from the 'inflation'
     table in the database. The retrieved data includes record ID, month, and inflation value,
-    sorted by month and record ID in descending order.
+    sorted by month and record ID in descending order. The result is cached until the
+    database changes.
 
     Returns:
         DataFrame: A DataFrame containing inflation data.
@@ -101,10 +507,13 @@ def custom_query_inf():
         ORDER BY mes desc, id_registro desc
     '''
 
-    conexion = conexionDB().conexion
+    def leer():
+        conexion = conexionDB()
+
+        df_inf = execute_queries_df_inf(sql=sql_inf, conexion=conexion.conexion)
 
-    df_inf = execute_queries_df_inf(sql=sql_inf, conexion=conexion)
+        conexion.cerrar()
 
-    conexion.close()
+        return df_inf
 
-    return df_inf
+    return cacheado(('custom_query_inf',), leer)
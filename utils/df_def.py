@@ -1,6 +1,39 @@
+from functools import cached_property
+import numpy as np
 import pandas as pd
 
 
+# Categories of the records, as stored in 'categoria'.
+CATEGORIAS = ['1. FCI', '2. Cedear', '3. Accion', '4. USD']
+
+# Spellings of each category accepted by validar_lote, besides the stored one and its digit.
+CATEGORIAS_SINONIMOS = {
+    'fci': '1. FCI',
+    'fcis': '1. FCI',
+    'cedear': '2. Cedear',
+    'cedears': '2. Cedear',
+    'accion': '3. Accion',
+    'acción': '3. Accion',
+    'acciones': '3. Accion',
+    'usd': '4. USD',
+    'dolar': '4. USD',
+    'dólar': '4. USD',
+    'dolares': '4. USD',
+    }
+
+# dtypes of the history frames, applied by tipar_historial. The amounts stay float64 so that the
+# daily totals of long histories keep their cents; only 'gan%', a ratio shown with 2 decimals, is float32.
+TIPOS_HIST = {
+    'id_registro': 'int32',
+    'fecha_compra': 'datetime64[ns]',
+    'categoria': 'category',
+    'categoria_cod': 'int8',
+    'ticker': 'category',
+    'fecha_upd': 'datetime64[ns]',
+    'gan%': 'float32',
+    }
+
+
 def execute_queries_df_inf(sql, conexion):
     """
     Execute SQL query and return the result as a pandas DataFrame.
@@ -18,13 +51,14 @@ def execute_queries_df_inf(sql, conexion):
     return pd.read_sql_query(sql, conexion)
 
 
-def execute_queries_df_last(sql_last, conexion):
+def execute_queries_df_last(sql_last, conexion, params=None):
     """
     Execute SQL query to fetch the last data entries and perform calculations on the DataFrame.
 
     Parameters:
     - sql_last (str): The SQL query to fetch the last data entries.
     - conexion: The connection object to the database.
+    - params (tuple or dict, optional): The parameters bound to the SQL query.
 
     Returns:
     pandas.DataFrame: A DataFrame containing the last data entries with additional calculated columns.
@@ -35,20 +69,21 @@ def execute_queries_df_last(sql_last, conexion):
     - It calculates 'diferencia' by subtracting 'monto_actual' from 'monto'.
     - It calculates 'gan%' by dividing 'diferencia' by 'monto' and multiplying by 100.
     """
-    df_last = pd.read_sql_query(sql_last, conexion)
+    df_last = pd.read_sql_query(sql_last, conexion, params=params)
     df_last['monto_actual'] = df_last['valor_actual'] * df_last['cantidad']
     df_last['diferencia'] = df_last['monto_actual'] - df_last['monto']
     df_last['gan%'] = df_last['diferencia'] / df_last['monto'] * 100
     return df_last
 
 
-def execute_queries_df_hist(sql_hist, conexion):
+def execute_queries_df_hist(sql_hist, conexion, params=None):
     """
     Execute SQL query to fetch historical data and perform calculations on the DataFrame.
 
     Parameters:
     - sql_hist (str): The SQL query to fetch historical data.
     - conexion: The connection object to the database.
+    - params (tuple or dict, optional): The parameters bound to the SQL query.
 
     Returns:
     pandas.DataFrame: A DataFrame containing the historical data with additional calculated columns.
@@ -59,13 +94,180 @@ def execute_queries_df_hist(sql_hist, conexion):
     - It calculates 'diferencia' by subtracting 'monto_actual' from 'monto'.
     - It calculates 'gan%' by dividing 'diferencia' by 'monto' and multiplying by 100.
     """
-    df_hist = pd.read_sql_query(sql_hist, conexion)
+    df_hist = pd.read_sql_query(sql_hist, conexion, params=params)
     df_hist['monto_actual'] = df_hist['valor_actual'] * df_hist['cantidad']
     df_hist['diferencia'] = df_hist['monto_actual'] - df_hist['monto']
     df_hist['gan%'] = df_hist['diferencia'] / df_hist['monto'] * 100
+    return tipar_historial(df_hist)
+
+
+def tipar_historial(df_hist):
+    """
+    Apply the TIPOS_HIST dtypes to the columns of a history DataFrame.
+
+    Parameters:
+    - df_hist (pandas.DataFrame): DataFrame containing historical data, as read from the database or already typed.
+
+    Returns:
+    pandas.DataFrame: The same DataFrame, modified in place, with 'categoria_cod' inserted after 'categoria'.
+
+    Notes:
+    - The dates are parsed once here, so the group-bys by 'fecha_upd' work on datetime64 instead of strings.
+    - 'categoria' and 'ticker' become categoricals, whose inferred categories are sorted, so they group and sort like the strings did
+      and '.str.contains' only runs on the distinct values.
+    - 'categoria_cod' is the leading digit of 'categoria', like the column of the same name in the database, or 0.
+    - It is idempotent, e.g. to restore the categoricals after concatenating pages with different tickers.
+    """
+    for columna in ('fecha_compra', 'fecha_upd'):
+        if df_hist[columna].dtype != TIPOS_HIST[columna]:
+            # Only the distinct dates are parsed; missing ones have the code -1, which takes the NaT appended last.
+            fechas = df_hist[columna].astype('category')
+            distintas = pd.to_datetime(fechas.cat.categories, format='ISO8601', errors='coerce').to_numpy()
+            distintas = np.append(distintas, np.datetime64('NaT')).astype(TIPOS_HIST[columna])
+            df_hist[columna] = distintas[fechas.cat.codes.to_numpy()]
+    for columna in ('categoria', 'ticker'):
+        if not isinstance(df_hist[columna].dtype, pd.CategoricalDtype):
+            df_hist[columna] = df_hist[columna].astype('category')
+
+    categorias = df_hist['categoria'].cat.categories
+    # Missing categories have the code -1, which takes the 0 appended last.
+    codigos = np.append(pd.to_numeric(categorias.str[:1], errors='coerce').fillna(0), 0).astype(TIPOS_HIST['categoria_cod'])
+    categoria_cod = codigos[df_hist['categoria'].cat.codes.to_numpy()]
+    if 'categoria_cod' in df_hist.columns:
+        df_hist['categoria_cod'] = categoria_cod
+    else:
+        df_hist.insert(df_hist.columns.get_loc('categoria') + 1, 'categoria_cod', categoria_cod)
+
+    for columna in ('id_registro', 'gan%'):
+        df_hist[columna] = df_hist[columna].astype(TIPOS_HIST[columna])
     return df_hist
 
 
+def execute_queries_df_summary(sql, conexion, params=None):
+    """
+    Execute SQL query on the daily rollup tables and return the result as a pandas DataFrame.
+
+    Parameters:
+    - sql (str): The SQL query on daily_portfolio_summary or daily_category_summary.
+    - conexion: The connection object to the database.
+    - params (tuple or dict, optional): The parameters bound to the SQL query.
+
+    Returns:
+    pandas.DataFrame: A DataFrame containing the result of the SQL query.
+
+    Notes:
+    - The rollups are already aggregated per day, so no columns are calculated here.
+    """
+    return pd.read_sql_query(sql, conexion, params=params)
+
+
+def _a_numero(serie, decimal=','):
+    """
+    Convert a Series to numbers written with the given decimal separator, accepting '$' and spaces.
+
+    The other separator is only accepted as a thousands separator in groups of three digits, so values that
+    do not fit the chosen format, like '1,234.56' with decimal ',', come out as NaN instead of being guessed.
+    """
+    miles = '.' if decimal == ',' else ','
+    texto = serie.astype(str).str.replace(r'[$\s]', '', regex=True)
+    validos = texto.str.fullmatch(rf'-?(\d{{1,3}}(\{miles}\d{{3}})+|\d+)(\{decimal}\d+)?')
+    texto = texto.where(validos).str.replace(miles, '', regex=False).str.replace(decimal, '.', regex=False)
+    return pd.to_numeric(texto, errors='coerce')
+
+
+def validar_lote(df, decimal=','):
+    """
+    Validate and normalize a batch of records to import, in a single vectorized pass.
+
+    Parameters:
+    - df (pandas.DataFrame): DataFrame with the columns 'fecha_compra', 'categoria', 'ticker', 'cantidad' and 'monto', as mapped from a broker CSV.
+    - decimal (str): The decimal separator of 'cantidad' and 'monto', ',' (1.234,56) or '.' (1,234.56).
+
+    Returns:
+    pandas.DataFrame: The valid records, normalized, ready for functions.guardar_lote.
+    pandas.DataFrame: The invalid rows as they came, with an 'error' column listing what is wrong.
+
+    Notes:
+    - 'fecha_compra' is parsed as 'YYYY-MM-DD' or else day first, and formatted as 'YYYY-MM-DD'.
+    - 'categoria' accepts the stored labels, their digit or the category names in CATEGORIAS_SINONIMOS.
+    - 'ticker' is stripped and upper-cased; USD records without one get 'USD'.
+    - 'cantidad' and 'monto' must be positive numbers in the chosen format; ambiguous values like '1.500' are
+      read as that format says and values mixing both formats are rejected.
+    """
+    lote = pd.DataFrame(index=df.index)
+    fechas = pd.to_datetime(df['fecha_compra'], errors='coerce', format='%Y-%m-%d')
+    sin_iso = fechas.isna() & df['fecha_compra'].notna()
+    fechas[sin_iso] = pd.to_datetime(df['fecha_compra'][sin_iso], errors='coerce', dayfirst=True)
+    lote['fecha_compra'] = fechas.dt.strftime('%Y-%m-%d')
+
+    categorias = {**CATEGORIAS_SINONIMOS, **{c.lower(): c for c in CATEGORIAS}, **{c[0]: c for c in CATEGORIAS}}
+    lote['categoria'] = df['categoria'].astype(str).str.strip().str.lower().map(categorias)
+
+    lote['ticker'] = df['ticker'].fillna('').astype(str).str.strip().str.upper()
+    lote.loc[lote['ticker'].eq('') & lote['categoria'].eq('4. USD'), 'ticker'] = 'USD'
+
+    lote['cantidad'] = _a_numero(df['cantidad'], decimal)
+    lote['monto'] = _a_numero(df['monto'], decimal)
+
+    errores = pd.DataFrame({
+        'fecha_compra invalida': lote['fecha_compra'].isna(),
+        'categoria invalida': lote['categoria'].isna(),
+        'ticker vacio': lote['ticker'].eq(''),
+        'cantidad invalida': ~(lote['cantidad'] > 0),
+        'monto invalido': ~(lote['monto'] > 0),
+    })
+    invalidas = errores.any(axis=1)
+
+    df_errores = df[invalidas].copy()
+    df_errores['error'] = errores[invalidas].dot(errores.columns + ', ').str.rstrip(', ')
+    return lote[~invalidas].reset_index(drop=True), df_errores
+
+
+def _ultimo_y_anterior(df, grupo, columnas):
+    """
+    Get the last and second to last rows of each group, without building per-group lists.
+
+    Parameters:
+    - df (pandas.DataFrame): DataFrame sorted by date within each group.
+    - grupo (str): The column to group by.
+    - columnas (list): The columns to return.
+
+    Returns:
+    pandas.DataFrame: The last values of the columns, indexed by group.
+    pandas.DataFrame: The second to last values, aligned with the first; NaN for groups with a single row.
+    """
+    agrupado = df.groupby(grupo, observed=True)
+    ultimo = agrupado.nth(-1).set_index(grupo)[columnas]
+    anterior = agrupado.nth(-2).set_index(grupo)[columnas].reindex(ultimo.index)
+    return ultimo, anterior
+
+
+def _listas_por_grupo(df, grupo, columna):
+    """
+    Get the values of a column as one list per group, for the LineChartColumn sparklines.
+
+    Parameters:
+    - df (pandas.DataFrame): DataFrame sorted by date within each group.
+    - grupo (str): The column to group by.
+    - columna (str): The column whose values are listed.
+
+    Returns:
+    pandas.Series: A list of values per group, indexed by group.
+    """
+    if df.empty:
+        return pd.Series(dtype=object)
+    if not df[grupo].is_monotonic_increasing:
+        df = df.sort_values(grupo, kind='stable')
+    claves = df[grupo].to_numpy()
+    cortes = np.flatnonzero(claves[1:] != claves[:-1]) + 1
+    return pd.Series([valores.tolist() for valores in np.split(df[columna].to_numpy(), cortes)], index=claves[np.r_[0, cortes]])
+
+
+def _porcentaje(ultimo, anterior):
+    """Return the % change from anterior to ultimo, rounded to 2 decimals."""
+    return (((ultimo - anterior) / anterior) * 100).round(2)
+
+
 def last_usd_total(df_last):
     """
     Calculate the total USD amount grouped by category from the last DataFrame.
@@ -122,13 +324,16 @@ def last_cat_summary(df_last):
     return df_last.groupby(['categoria']).agg({'monto': 'sum', 'monto_actual': 'sum', 'diferencia': 'sum'}).round().reset_index()
 
 
-def last_cat_ev_summ(df_last, df_hist):
+def last_cat_ev_summ(df_last, df_hist, df_hist_day_summ=None, df_last_cat_summ=None, listas=True):
     """
     Summarize the evolution of data from the last DataFrame grouped by category.
 
     Parameters:
     - df_last (pandas.DataFrame): DataFrame containing the last data entries.
     - df_hist (pandas.DataFrame): DataFrame containing historical data.
+    - df_hist_day_summ (pandas.DataFrame, optional): The hist_day_summary of df_hist, e.g. read from daily_portfolio_summary.
+    - df_last_cat_summ (pandas.DataFrame, optional): The last_cat_summary of df_last.
+    - listas (bool, optional): Whether to include the 'evolucion_*' sparkline lists. Defaults to True.
 
     Returns:
     pandas.DataFrame: A DataFrame summarizing the evolution of data grouped by category,
@@ -138,19 +343,24 @@ def last_cat_ev_summ(df_last, df_hist):
     Notes:
     - This function assumes that the input DataFrames contain columns including 'categoria', 'monto', 'monto_actual', and 'diferencia'.
     - It calculates the evolution of 'monto' and 'monto_actual' using historical data.
-    - It calculates the percentage difference between current and previous evolutions.
+    - It calculates the percentage difference between the last two days of the evolution.
     - It calculates the total 'diferencia' and its percentage of the total 'monto'.
     """
-    df_hist_day_summ = hist_day_summary(df_hist)
-    df_last_cat_summ = last_cat_summary(df_last=df_last)
+    if df_hist_day_summ is None:
+        df_hist_day_summ = hist_day_summary(df_hist)
+    if df_last_cat_summ is None:
+        df_last_cat_summ = last_cat_summary(df_last=df_last)
 
+    evolucion_actual = df_hist_day_summ['monto_actual'].round().to_numpy()
     df_last_cat_ev_summ = pd.DataFrame({'categoria': ['Total'],
                                         'monto': df_last_cat_summ['monto'].sum().round(),
                                         'evolucion_invertido': [df_hist_day_summ['monto'].round().tolist()],
                                         'monto_actual': df_last_cat_summ['monto_actual'].sum().round(),
-                                        'evolucion_actual': [df_hist_day_summ['monto_actual'].round().tolist()]
+                                        'evolucion_actual': [evolucion_actual.tolist()]
                                         })
-    df_last_cat_ev_summ['porcentaje_diferencia'] = (((df_last_cat_ev_summ['evolucion_actual'].apply(lambda x: x[-1]) - df_last_cat_ev_summ['evolucion_actual'].apply(lambda x: x[-2])) / df_last_cat_ev_summ['evolucion_actual'].apply(lambda x: x[-2])) * 100).round(2)
+    if not listas:
+        df_last_cat_ev_summ = df_last_cat_ev_summ.drop(columns=['evolucion_invertido', 'evolucion_actual'])
+    df_last_cat_ev_summ['porcentaje_diferencia'] = _porcentaje(evolucion_actual[-1], evolucion_actual[-2]) if len(evolucion_actual) > 1 else np.nan
     df_last_cat_ev_summ['diferencia_portafolio'] = df_last_cat_summ['diferencia'].sum().round()
     df_last_cat_ev_summ['porcentaje_dif_portafolio'] = ((df_last_cat_summ['diferencia'].sum().round() / df_last_cat_summ['monto'].sum().round())*100)
     return df_last_cat_ev_summ
@@ -172,18 +382,21 @@ def hist_day_cat_summary(df_hist):
     - It groups the data by 'categoria' and 'fecha_upd', and calculates the sum of 'monto' and 'monto_actual'.
     - It renames the columns to match the desired output format.
     """
-    df_hist_day_cat_summ = df_hist.groupby(['categoria', 'fecha_upd']).agg({'monto': 'sum', 'monto_actual': 'sum'}).reset_index()
+    df_hist_day_cat_summ = df_hist.groupby(['categoria', 'fecha_upd'], observed=True).agg({'monto': 'sum', 'monto_actual': 'sum'}).reset_index()
     df_hist_day_cat_summ.columns = ['categoria', 'fecha_upd', 'monto_actual', 'monto']
     return df_hist_day_cat_summ
 
 
-def last_cat_ev_summ_cat(df_last, df_hist):
+def last_cat_ev_summ_cat(df_last, df_hist, df_hist_day_cat_summ=None, df_last_cat_summ=None, listas=True):
     """
     Summarize the evolution of data from the last DataFrame grouped by category and update date.
 
     Parameters:
     - df_last (pandas.DataFrame): DataFrame containing the last data entries.
     - df_hist (pandas.DataFrame): DataFrame containing historical data.
+    - df_hist_day_cat_summ (pandas.DataFrame, optional): The hist_day_cat_summary of df_hist, e.g. read from daily_category_summary.
+    - df_last_cat_summ (pandas.DataFrame, optional): The last_cat_summary of df_last, whose 'diferencia' is used.
+    - listas (bool, optional): Whether to include the '*_lista' sparkline lists. Defaults to True.
 
     Returns:
     pandas.DataFrame: A DataFrame summarizing the evolution of data grouped by category,
@@ -193,20 +406,27 @@ def last_cat_ev_summ_cat(df_last, df_hist):
     Notes:
     - This function assumes that the input DataFrames contain columns including 'categoria', 'fecha_upd', 'monto', 'monto_actual', and 'diferencia'.
     - It calculates the evolution of 'monto' and 'monto_actual' using historical data.
-    - It calculates the percentage difference between current and previous evolutions.
+    - It calculates the percentage difference between the last two days of each category.
     - It calculates the total 'diferencia' and its percentage of the total 'monto_actual'.
     """
-    df_hist_day_cat_summ = hist_day_cat_summary(df_hist)
-
-    df_last_cat_ev_summ_cat = df_hist_day_cat_summ.groupby('categoria').agg(
-        monto_actual_sum_last=('monto_actual', 'last'),
-        monto_actual_lista=('monto_actual', list),
-        monto_sum_last=('monto', 'last'),
-        monto_sum_lista=('monto', list)
-    ).reset_index()
-    df_last_cat_ev_summ_cat['porcentaje_diferencia'] = (
-        ((df_last_cat_ev_summ_cat['monto_sum_lista'].apply(lambda x: x[-1]) - df_last_cat_ev_summ_cat['monto_sum_lista'].apply(lambda x: x[-2])) / df_last_cat_ev_summ_cat['monto_sum_lista'].apply(lambda x: x[-2])) * 100).round(2).apply(lambda x: f'{x:.2f}% {"🔴" if x < 0 else "🟢"}')
-    df_diferencia_portafolio = df_last.groupby(['categoria']).agg({'diferencia': 'sum'}).round().reset_index()
+    if df_hist_day_cat_summ is None:
+        df_hist_day_cat_summ = hist_day_cat_summary(df_hist)
+
+    ultimo, anterior = _ultimo_y_anterior(df_hist_day_cat_summ, 'categoria', ['monto_actual', 'monto'])
+    df_last_cat_ev_summ_cat = pd.DataFrame({
+        'categoria': ultimo.index,
+        'monto_actual_sum_last': ultimo['monto_actual'].to_numpy(),
+        'monto_sum_last': ultimo['monto'].to_numpy()
+    })
+    if listas:
+        df_last_cat_ev_summ_cat.insert(2, 'monto_actual_lista', _listas_por_grupo(df_hist_day_cat_summ, 'categoria', 'monto_actual').to_numpy())
+        df_last_cat_ev_summ_cat['monto_sum_lista'] = _listas_por_grupo(df_hist_day_cat_summ, 'categoria', 'monto').to_numpy()
+    porcentaje = _porcentaje(ultimo['monto'], anterior['monto']).to_numpy()
+    df_last_cat_ev_summ_cat['porcentaje_diferencia'] = [f'{x:.2f}% {"🔴" if x < 0 else "🟢"}' for x in porcentaje]
+    if df_last_cat_summ is None:
+        df_diferencia_portafolio = df_last.groupby(['categoria']).agg({'diferencia': 'sum'}).round().reset_index()
+    else:
+        df_diferencia_portafolio = df_last_cat_summ[['categoria', 'diferencia']]
 
     df_last_cat_ev_summ_cat = pd.merge(
         df_last_cat_ev_summ_cat,
@@ -220,12 +440,13 @@ def last_cat_ev_summ_cat(df_last, df_hist):
     return df_last_cat_ev_summ_cat
 
 
-def agrupado_ticker_resumen(df_hist):
+def agrupado_ticker_resumen(df_hist, listas=True):
     """
     Summarize data grouped by ticker and update date, focusing on the evolution of 'valor_actual'.
 
     Parameters:
     - df_hist (pandas.DataFrame): DataFrame containing historical data.
+    - listas (bool, optional): Whether to include the 'valor_actual_last_lista' sparkline lists. Defaults to True.
 
     Returns:
     pandas.DataFrame: A DataFrame summarizing data grouped by ticker,
@@ -236,15 +457,14 @@ def agrupado_ticker_resumen(df_hist):
     - It calculates the evolution of 'valor_actual' for each ticker using historical data.
     - It calculates the percentage difference between the current and previous values of 'valor_actual'.
     """
-    df_agrupado_ticker = df_hist.groupby(['ticker', 'fecha_upd']).agg({'valor_actual': 'last', 'categoria': 'last'}).reset_index()
+    df_agrupado_ticker = df_hist.groupby(['ticker', 'fecha_upd'], observed=True).agg({'valor_actual': 'last', 'categoria': 'last'}).reset_index()
     df_agrupado_ticker.columns = ['ticker', 'fecha_upd', 'valor_actual_last', 'categoria']
 
-    df_agrupado_ticker_resumen = df_agrupado_ticker.groupby('ticker').agg(
-        valor_actual_last=('valor_actual_last', 'last'),
-        categoria=('categoria', 'last'),
-        valor_actual_last_lista=('valor_actual_last', list)
-    ).reset_index()
-    df_agrupado_ticker_resumen['porcentaje_diferencia'] = (((df_agrupado_ticker_resumen['valor_actual_last_lista'].apply(lambda x: x[-1]) - df_agrupado_ticker_resumen['valor_actual_last_lista'].apply(lambda x: x[-2])) / df_agrupado_ticker_resumen['valor_actual_last_lista'].apply(lambda x: x[-2])) * 100).round(2)
+    ultimo, anterior = _ultimo_y_anterior(df_agrupado_ticker, 'ticker', ['valor_actual_last', 'categoria'])
+    df_agrupado_ticker_resumen = ultimo.reset_index()
+    if listas:
+        df_agrupado_ticker_resumen['valor_actual_last_lista'] = _listas_por_grupo(df_agrupado_ticker, 'ticker', 'valor_actual_last').to_numpy()
+    df_agrupado_ticker_resumen['porcentaje_diferencia'] = _porcentaje(ultimo['valor_actual_last'], anterior['valor_actual_last']).to_numpy()
     return df_agrupado_ticker_resumen
 
 
@@ -266,6 +486,75 @@ def last_ticker_summ(df_last):
     return df_last.groupby(['ticker']).agg({'categoria': 'last', 'monto': 'sum', 'monto_actual': 'sum', 'diferencia': 'sum'}).round().reset_index()
 
 
+class PortfolioFrames:
+    """
+    Build the summary frames of a portfolio computing the group-bys they share only once.
+
+    Parameters:
+    - df_last (pandas.DataFrame): DataFrame containing the last data entries.
+    - df_hist (pandas.DataFrame, optional): DataFrame containing historical data. Only needed for the frames not given below and for agrupado_ticker_resumen.
+    - df_hist_day_summ (pandas.DataFrame, optional): The hist_day_summary of df_hist, e.g. read from daily_portfolio_summary.
+    - df_hist_day_cat_summ (pandas.DataFrame, optional): The hist_day_cat_summary of df_hist, e.g. read from daily_category_summary.
+    - listas (bool, optional): Whether to build the sparkline lists, only needed by frames that are displayed. Defaults to True.
+
+    Notes:
+    - Each frame is an attribute named like the function computing it alone, built the first time it is read and kept.
+    - df_last is grouped by 'categoria' once, for last_usd_total, last_cat_summ, last_cat_ev_summ and last_cat_ev_summ_cat.
+    - df_hist is grouped by 'categoria' and 'fecha_upd' once; the daily totals are the sum over categories of that, much smaller, frame.
+    """
+
+    def __init__(self, df_last, df_hist=None, df_hist_day_summ=None, df_hist_day_cat_summ=None, listas=True):
+        self.df_last = df_last
+        self.df_hist = df_hist
+        self.listas = listas
+        if df_hist_day_summ is not None:
+            self.hist_day_summ = df_hist_day_summ
+        if df_hist_day_cat_summ is not None:
+            self.hist_day_cat_summ = df_hist_day_cat_summ
+
+    @cached_property
+    def _last_categoria(self):
+        return self.df_last.groupby(['categoria']).agg({'cantidad': 'sum', 'monto': 'sum', 'monto_actual': 'sum', 'diferencia': 'sum'}).reset_index()
+
+    @cached_property
+    def last_usd_total(self):
+        df_last_usd_total = self._last_categoria[['categoria', 'cantidad']].round()
+        return df_last_usd_total[df_last_usd_total['categoria'].str.contains("USD")]
+
+    @cached_property
+    def last_cat_summ(self):
+        return self._last_categoria[['categoria', 'monto', 'monto_actual', 'diferencia']].round()
+
+    @cached_property
+    def hist_day_cat_summ(self):
+        return hist_day_cat_summary(self.df_hist)
+
+    @cached_property
+    def hist_day_summ(self):
+        # hist_day_cat_summary names the sum of monto 'monto_actual' and the sum of monto_actual 'monto'.
+        df_hist_day_summ = self.hist_day_cat_summ.groupby(['fecha_upd'])[['monto_actual', 'monto']].sum().reset_index()
+        df_hist_day_summ.columns = ['fecha_upd', 'monto', 'monto_actual']
+        return df_hist_day_summ
+
+    @cached_property
+    def last_cat_ev_summ(self):
+        return last_cat_ev_summ(self.df_last, self.df_hist, df_hist_day_summ=self.hist_day_summ, df_last_cat_summ=self.last_cat_summ,
+                                listas=self.listas)
+
+    @cached_property
+    def last_cat_ev_summ_cat(self):
+        return last_cat_ev_summ_cat(self.df_last, self.df_hist, df_hist_day_cat_summ=self.hist_day_cat_summ, df_last_cat_summ=self.last_cat_summ,
+                                    listas=self.listas)
+
+    @cached_property
+    def agrupado_ticker_resumen(self):
+        return agrupado_ticker_resumen(self.df_hist, listas=self.listas)
+
+    @cached_property
+    def last_ticker_summ(self):
+        return last_ticker_summ(self.df_last)
+
+
 def inf_mensual(df):
     """
     Calculate monthly inflation rate based on the DataFrame.
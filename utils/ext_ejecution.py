@@ -1,39 +1,89 @@
-from functions import actualizar, appendear_historical
+import sys
+import time
+import datetime as dt
+from functions import actualizar, appendear_historical, compactar_historial, planificar_actualizacion
 from db_conn import conexionDB
+from hist_arrow import exportar_historial
+from quotes import CACHE_TTL
 from telegram_post import telegram_bot_sendtext
 from db_conn import custom_query_resume
-from df_def import last_usd_total, last_cat_ev_summ, last_cat_ev_summ_cat, hist_day_summary, agrupado_ticker_resumen, hist_day_cat_summary, last_ticker_summ
-
-conexion = conexionDB()
-actualizar(conexion)
-appendear_historical(conexion)
-conexion.cerrar()
-
-
-# DFs generation
-# ---------------------------------------------------------------------------------------------------------------
-# ---------------------------------------------------------------------------------------------------------------
-df_hist, df_last = custom_query_resume(divider=1, table_suf="")
-# ---------------------------------------------------------------------------------------------------------------
-# ---------------------------------------------------------------------------------------------------------------
-
-# DFs transformations
-# ---------------------------------------------------------------------------------------------------------------
-# ---------------------------------------------------------------------------------------------------------------
-df_last_usd_total = last_usd_total(df_last=df_last)
-df_last_cat_ev_summ = last_cat_ev_summ(df_last=df_last, df_hist=df_hist)
-df_last_cat_ev_summ_cat = last_cat_ev_summ_cat(df_last=df_last, df_hist=df_hist)
-df_hist_day_summ = hist_day_summary(df_hist=df_hist)
-df_agrupado_ticker_resumen = agrupado_ticker_resumen(df_hist=df_hist)
-df_hist_day_cat_summ = hist_day_cat_summary(df_hist=df_hist)
-df_last_ticker_summ = last_ticker_summ(df_last=df_last)
-
-df_agrupado_ticker_resumen_categoria = df_agrupado_ticker_resumen[df_agrupado_ticker_resumen['categoria'].str.contains('USD')]
-
-# ---------------------------------------------------------------------------------------------------------------
-# ---------------------------------------------------------------------------------------------------------------
-
-telegram_msj = f"""Fecha de actualizacion: _{df_last['fecha_upd'][0]}_\n
+from df_def import PortfolioFrames
+
+
+# Minimum time between two refreshes of each instrument class in daemon mode. Within a refresh only
+# the holdings whose fecha_upd is stale are fetched (see functions.esta_vencido).
+CADENCIAS = {
+    'fci': dt.timedelta(hours=6),
+    'yf': dt.timedelta(minutes=30),
+    'usd': dt.timedelta(hours=1)
+    }
+TICK = 60
+
+
+def refrescar(sources=None, solo_vencidos=True):
+    """Refresh the prices of the given instrument classes, append them to the history and export it to Arrow.
+
+    A quote cached by an earlier refresh is reused only if it is younger than the shortest cadence of
+    the classes refreshed, so a class refreshed more often than CACHE_TTL still gets fresh quotes.
+
+    Args:
+        sources (iterable): The quote sources to refresh. Defaults to all of them.
+        solo_vencidos (bool): Only fetch the holdings whose fecha_upd is stale. Defaults to True.
+
+    Returns:
+        None
+    """
+    ttl = min([CACHE_TTL] + [CADENCIAS[source] for source in sources or CADENCIAS])
+    conexion = conexionDB()
+    actualizar(conexion, sources=sources, solo_vencidos=solo_vencidos, ttl=ttl)
+    appendear_historical(conexion)
+    exportar_historial(conexion)
+    conexion.cerrar()
+
+
+def compactar():
+    """Compact the old history (see functions.compactar_historial) and export it to Arrow again if it changed.
+
+    Returns:
+        None
+    """
+    conexion = conexionDB()
+    compactados = compactar_historial(conexion)
+    conexion.conexion.commit()
+    if compactados:
+        print(f"Compactacion: {len(compactados)} periodos, {sum(c[3] - c[4] for c in compactados)} filas eliminadas")
+        exportar_historial(conexion)
+    conexion.cerrar()
+
+
+def enviar_resumen():
+    """Send the portfolio summary of the last update via Telegram.
+
+    Returns:
+        None
+    """
+    # DFs generation
+    # ---------------------------------------------------------------------------------------------------------------
+    # ---------------------------------------------------------------------------------------------------------------
+    df_hist, df_last = custom_query_resume(divider=1, portfolio="principal")
+    # ---------------------------------------------------------------------------------------------------------------
+    # ---------------------------------------------------------------------------------------------------------------
+
+    # DFs transformations
+    # ---------------------------------------------------------------------------------------------------------------
+    # ---------------------------------------------------------------------------------------------------------------
+    # The message only needs the last changes, not the sparkline lists.
+    frames = PortfolioFrames(df_last=df_last, df_hist=df_hist, listas=False)
+    df_last_cat_ev_summ = frames.last_cat_ev_summ
+    df_last_cat_ev_summ_cat = frames.last_cat_ev_summ_cat
+    df_agrupado_ticker_resumen = frames.agrupado_ticker_resumen
+
+    df_agrupado_ticker_resumen_categoria = df_agrupado_ticker_resumen[df_agrupado_ticker_resumen['categoria'].str.contains('USD')]
+
+    # ---------------------------------------------------------------------------------------------------------------
+    # ---------------------------------------------------------------------------------------------------------------
+
+    telegram_msj = f"""Fecha de actualizacion: _{df_last['fecha_upd'][0]}_\n
 *Portafolio: {df_last_cat_ev_summ['porcentaje_diferencia'][0]}%  {"🟢" if df_last_cat_ev_summ['porcentaje_diferencia'][0]>0 else "🔴"}*\n
 -------- Resumen por instrumento --------
 FCI: {df_last_cat_ev_summ_cat['porcentaje_diferencia'][0].split('%')[0]}% {"🟢" if float(df_last_cat_ev_summ_cat['porcentaje_diferencia'][0].split('%')[0])>0 else "🔴"}
@@ -42,4 +92,80 @@ Accion: {df_last_cat_ev_summ_cat['porcentaje_diferencia'][2].split('%')[0]}% {"
 USD (${df_agrupado_ticker_resumen_categoria['valor_actual_last'].iloc[0]}): {df_last_cat_ev_summ_cat['porcentaje_diferencia'][3].split('%')[0]}% {"🟢" if float(df_last_cat_ev_summ_cat['porcentaje_diferencia'][3].split('%')[0])>0 else "🔴"}
 -------------------------------------------------------------"""
 
-telegram_bot_sendtext(telegram_msj)
+    telegram_bot_sendtext(telegram_msj)
+
+
+def fci_al_dia():
+    """Return whether every FCI holding already has the latest published quote (see functions.esta_vencido).
+
+    Returns:
+        bool: True if no FCI holding is stale.
+    """
+    conexion = conexionDB()
+    try:
+        return not planificar_actualizacion(conexion, sources=['fci'], solo_vencidos=True)
+    finally:
+        conexion.cerrar()
+
+
+def ejecutar():
+    """Refresh every instrument, append and compact the history and send the Telegram summary once."""
+    refrescar()
+    compactar()
+    enviar_resumen()
+
+
+def daemon():
+    """Keep the prices fresh, refreshing each instrument class on its own cadence.
+
+    Every TICK seconds the classes whose CADENCIAS interval elapsed are refreshed, fetching only
+    their stale holdings. The Telegram summary is sent once a day, after the first successful FCI
+    refresh that leaves every FCI holding with the latest published quote, so it doesn't report the
+    changes of the day before while the funds haven't published yet. The history is compacted once
+    a day.
+
+    Returns:
+        None
+    """
+    ultima = {}
+    ultimo_resumen = None
+    ultima_compactacion = None
+    while True:
+        ahora = dt.datetime.now()
+        sources = [source for source, cadencia in CADENCIAS.items()
+                   if source not in ultima or ahora - ultima[source] >= cadencia]
+
+        refrescado = False
+        if sources:
+            try:
+                refrescar(sources=sources)
+                ultima.update({source: ahora for source in sources})
+                refrescado = True
+            except Exception as e:
+                print("Error daemon: ", e)
+
+        if refrescado and 'fci' in sources and ultimo_resumen != ahora.date():
+            try:
+                if fci_al_dia():
+                    enviar_resumen()
+                    ultimo_resumen = ahora.date()
+            except Exception as e:
+                print("Error telegram: ", e)
+
+        if ultima_compactacion != ahora.date():
+            try:
+                compactar()
+                ultima_compactacion = ahora.date()
+            except Exception as e:
+                print("Error compactacion: ", e)
+
+        time.sleep(TICK)
+
+
+if __name__ == '__main__':
+    if '--daemon' in sys.argv:
+        daemon()
+    elif '--compactar' in sys.argv:
+        compactar()
+    else:
+        ejecutar()
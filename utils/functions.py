@@ -1,8 +1,34 @@
-import pandas as pd
 import datetime as dt
-import yfinance as yf
-import requests
-import json
+import os
+try:
+    from quotes import CotizacionEnCache, fetch_all, nueva_corrida
+    from migrations import PORTFOLIOS
+except:
+    from utils.quotes import CotizacionEnCache, fetch_all, nueva_corrida
+    from utils.migrations import PORTFOLIOS
+
+# Quote source of each category, keyed by the first character of 'categoria'.
+SOURCE_BY_TIPO = {
+    '1': 'fci',
+    '2': 'yf',
+    '3': 'yf',
+    '4': 'usd'
+    }
+
+# Local hours during which stock/CEDEAR and USD blue quotes move on weekdays.
+HORARIO_MERCADO = (dt.time(11, 0), dt.time(17, 0))
+HORARIO_USD = (dt.time(10, 0), dt.time(18, 0))
+
+# History older than DIAS_DIARIO days is compacted to weekly snapshots, and older than DIAS_SEMANAL
+# days to monthly ones. Each level is (nivel, age in days, strftime format of its periods). Weeks are
+# cut at month ends, so the weekly snapshots never move a value across months and the monthly level
+# still finds the last snapshot of each month.
+DIAS_DIARIO = int(os.environ.get('ST_HIST_DIAS_DIARIO', 180))
+DIAS_SEMANAL = int(os.environ.get('ST_HIST_DIAS_SEMANAL', 730))
+NIVELES_COMPACTACION = (
+    ('semanal', DIAS_DIARIO, '%G-W%V-%m'),
+    ('mensual', DIAS_SEMANAL, '%Y-%m')
+    )
 
 
 class Registro:
@@ -52,16 +78,18 @@ class Registro:
     {self.ticker}, {self.cantidad}, {self.monto}]'''
 
 
-def guardar(registro, conexion):
+def guardar(registro, conexion, portfolio='principal'):
     """Save a financial record to the database.
 
-    This function saves a given financial record to the database. The record's details are extracted
-    based on the record's category and ticker symbol. The appropriate SQL statement is constructed
-    based on the category and current market data, and then executed using the database connection.
+    This function saves a given financial record to the 'holdings' table of the database. The current quote
+    of the record is fetched through quotes.fetch_all based on the record's category and ticker symbol, reusing
+    the quote_cache table when possible. The record gets the next id of its portfolio and the SQL statements
+    are then executed using the database connection, which the caller commits and closes.
 
     Args:
         registro (Registro): An instance of the Registro class representing the financial record to be saved.
         conexion: The database connection to execute the SQL statement.
+        portfolio (str): The portfolio the record belongs to. Defaults to 'principal'.
 
     Returns:
         None
@@ -69,73 +97,125 @@ def guardar(registro, conexion):
     Raises:
         None
     """
-    tipo = registro.categoria[:1]
-
-    # ------------------------------------------------------------------------------------------------------------------------------------------------------------
-    # --------------------------------------------------------------- FCIs ---------------------------------------------------------------------------------------
-    # ------------------------------------------------------------------------------------------------------------------------------------------------------------
-
-    if tipo == "1":
-        tables = pd.read_html(f"https://www.bullmarketbrokers.com/Information/FundData?ticker={registro.ticker}", decimal=',', thousands='.')
-
-        valor_actual = tables[1][1][0]
-        date_str = tables[1][1][1]
-        date_object = dt.datetime.strptime(date_str, '%d/%m/%Y').date()
-
-        sql = f"""INSERT INTO finance (fecha_compra, categoria, ticker, cantidad, monto, valor_actual, fecha_upd)
-    VALUES('{registro.fecha_compra}', '{registro.categoria}', '{registro.ticker}', '{registro.cantidad}', {registro.monto}, {valor_actual}, '{date_object}')"""
-
-    # ------------------------------------------------------------------------------------------------------------------------------------------------------------
-    # ---------------------------------------------------------- ACCIONES/CEDEARs --------------------------------------------------------------------------------
-    # ------------------------------------------------------------------------------------------------------------------------------------------------------------
-
-    if tipo == "2" or tipo == "3":
-        data = yf.download(registro.ticker, period="5d", interval="1d")
+    source = SOURCE_BY_TIPO.get(registro.categoria[:1])
+    if source is None:
+        print("Error categoria sin cotizacion: ", registro.categoria, registro.ticker)
+        return
+    key = (source, 'USD') if source == 'usd' else (source, registro.ticker)
+
+    nueva_corrida()
+    # FCIs are quoted from bullmarket, stocks/CEDEARs from yfinance and USDs from bluelytics,
+    # reusing the quote_cache entry when it is still within its TTL.
+    cotizacion = fetch_all([key], cursor=conexion.cursor)[key]
+    if isinstance(cotizacion, CotizacionEnCache):
+        # A new record can start from the last cached price, dated with its own quote date.
+        print(f"Usando ultima cotizacion en cache {source}: ", registro.ticker, cotizacion)
+        cotizacion = cotizacion.cotizacion
+    if isinstance(cotizacion, Exception):
+        print(f"Error {source}: ", registro.ticker, cotizacion)
+        return
+
+    valor_actual, date_object = cotizacion
+
+    sql_id = """UPDATE portfolios SET ultimo_id = ultimo_id + 1 WHERE portfolio = ?"""
+
+    sql = f"""INSERT INTO holdings (portfolio, id_registro, fecha_compra, categoria, ticker, cantidad, monto, valor_actual, fecha_upd)
+    VALUES(?, (SELECT ultimo_id FROM portfolios WHERE portfolio = ?),
+    '{registro.fecha_compra}', '{registro.categoria}', '{registro.ticker}', '{registro.cantidad}', {registro.monto}, {valor_actual}, '{date_object}')"""
+
+    # The id is only taken if the insert succeeds, so a failed record doesn't leave a gap committed.
+    conexion.cursor.execute('SAVEPOINT guardar')
+    try:
+        print(f"'{registro.fecha_compra}', '{registro.categoria}', '{registro.ticker}', '{registro.cantidad}', {registro.monto}, {valor_actual}, '{dt.date.today()}'")
+        conexion.cursor.execute(sql_id, (portfolio,))
+        conexion.cursor.execute(sql, (portfolio, portfolio))
 
-        closing_price = data['Close'][0]
-        date_object = data.index[0].to_pydatetime().date()
+    except Exception as e:
+        print(e.args)
+        conexion.cursor.execute('ROLLBACK TO guardar')
+    finally:
+        conexion.cursor.execute('RELEASE guardar')
 
-        sql = f"""INSERT INTO finance (fecha_compra, categoria, ticker, cantidad, monto, valor_actual, fecha_upd)
-    VALUES('{registro.fecha_compra}', '{registro.categoria}', '{registro.ticker}', '{registro.cantidad}', {registro.monto}, {closing_price}, '{date_object}')"""
 
-    # ------------------------------------------------------------------------------------------------------------------------------------------------------------
-    # --------------------------------------------------------------- USDs ---------------------------------------------------------------------------------------
-    # ------------------------------------------------------------------------------------------------------------------------------------------------------------
+def guardar_lote(df_lote, conexion, portfolio='principal'):
+    """Save a batch of financial records to the database in one transaction.
 
-    if tipo == "4":
-        url = "https://api.bluelytics.com.ar/v2/latest"
-        res = requests.get(url)
+    The records, as validated by df_def.validar_lote, are quoted through quotes.fetch_all once per distinct
+    quote, concurrently and reusing the quote_cache table. A quote that failed but was cached before is used
+    with its own quote date; the records whose quote failed otherwise, or whose category has no quote source,
+    are left out.
+    The rest get a block of consecutive ids of their portfolio and are inserted into 'holdings' with a
+    single executemany, which is committed or, on error, rolled back as a whole.
 
-        res = json.loads(res.content)
-        valor_actual = res['blue']['value_buy']
+    Args:
+        df_lote (DataFrame): The records, with the columns 'fecha_compra', 'categoria', 'ticker', 'cantidad' and 'monto'.
+        conexion: The database connection to execute the SQL statements.
+        portfolio (str): The portfolio the records belong to. Defaults to 'principal'.
 
-        sql = f"""INSERT INTO finance (fecha_compra, categoria, ticker, cantidad, monto, valor_actual, fecha_upd)
-    VALUES('{registro.fecha_compra}', '{registro.categoria}', '{registro.ticker}', '{registro.cantidad}', {registro.monto}, {valor_actual}, '{dt.date.today()}')"""
+    Returns:
+        int: The number of records inserted.
+        list: A (ticker, error) tuple per record left out.
 
-    else:
-        pass
+    Raises:
+        None
+    """
+    keys = []
+    for categoria, ticker in zip(df_lote['categoria'], df_lote['ticker']):
+        source = SOURCE_BY_TIPO.get(str(categoria)[:1])
+        if source is None:
+            keys.append(None)
+        else:
+            keys.append((source, 'USD') if source == 'usd' else (source, ticker))
+
+    nueva_corrida()
+    cotizaciones = fetch_all(list(dict.fromkeys(key for key in keys if key is not None)), cursor=conexion.cursor)
+
+    filas = []
+    errores = []
+    for registro, key in zip(df_lote.itertuples(index=False), keys):
+        if key is None:
+            errores.append((registro.ticker, f"categoria sin cotizacion: {registro.categoria}"))
+            continue
+        cotizacion = cotizaciones[key]
+        if isinstance(cotizacion, CotizacionEnCache):
+            cotizacion = cotizacion.cotizacion
+        if isinstance(cotizacion, Exception):
+            errores.append((registro.ticker, str(cotizacion)))
+            continue
+        valor_actual, date_object = cotizacion
+        filas.append((registro.fecha_compra, registro.categoria, registro.ticker, registro.cantidad, registro.monto,
+                      valor_actual, str(date_object)))
+
+    if not filas:
+        return 0, errores
 
     try:
-        print(f"'{registro.fecha_compra}', '{registro.categoria}', '{registro.ticker}', '{registro.cantidad}', {registro.monto}, {valor_actual}, '{dt.date.today()}'")
-        conexion.cursor.execute(sql)
-        conexion.close()
-
+        conexion.cursor.execute('UPDATE portfolios SET ultimo_id = ultimo_id + ? WHERE portfolio = ?', (len(filas), portfolio))
+        conexion.cursor.execute('SELECT ultimo_id FROM portfolios WHERE portfolio = ?', (portfolio,))
+        primer_id = conexion.cursor.fetchone()[0] - len(filas) + 1
+        conexion.cursor.executemany('''INSERT INTO holdings(portfolio, id_registro, fecha_compra, categoria, ticker, cantidad, monto, valor_actual, fecha_upd)
+            VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?)''', [(portfolio, primer_id + i, *fila) for i, fila in enumerate(filas)])
+        conexion.conexion.commit()
     except Exception as e:
-        print(e.args)
-        conexion.close()
+        print("Error importacion: ", e)
+        conexion.conexion.rollback()
+        return 0, errores + [(fila[2], str(e)) for fila in filas]
+
+    return len(filas), errores
 
 
-def editar(registro, conexion, id_registro):
+def editar(registro, conexion, id_registro, portfolio='principal'):
     """Edit a financial record in the database.
 
-    This function updates a specific financial record in the 'finance' table of the database.
-    The record is identified by the provided 'id_registro' parameter. The record's details are
-    updated based on the attributes of the 'registro' object.
+    This function updates a specific financial record in the 'holdings' table of the database.
+    The record is identified by the provided 'portfolio' and 'id_registro' parameters. The record's
+    details are updated based on the attributes of the 'registro' object.
 
     Args:
         registro (Registro): An instance of the Registro class representing the updated financial record.
         conexion: The database connection to execute the SQL statement.
         id_registro (int): An integer representing the ID of the record to be edited.
+        portfolio (str): The portfolio the record belongs to. Defaults to 'principal'.
 
     Returns:
         None
@@ -143,27 +223,26 @@ def editar(registro, conexion, id_registro):
     Raises:
         None
     """
-    sql = f"""UPDATE finance
+    sql = f"""UPDATE holdings
     SET fecha_compra='{registro.fecha_compra}', categoria='{registro.categoria}', ticker='{registro.ticker}', cantidad='{registro.cantidad}', monto='{registro.monto}'
-    WHERE id_registro={id_registro}"""
+    WHERE portfolio=? AND id_registro={id_registro}"""
 
     try:
-        conexion.cursor.execute(sql)
-        conexion.close()
+        conexion.cursor.execute(sql, (portfolio,))
     except Exception as e:
         print(e.with_traceback)
-        conexion.close()
 
 
-def eliminar(id_registro, conexion):
+def eliminar(id_registro, conexion, portfolio='principal'):
     """Delete a financial record from the database.
 
-    This function deletes a specific financial record from the 'finance' table of the database.
-    The record to be deleted is identified by the provided 'id_registro' parameter.
+    This function deletes a specific financial record from the 'holdings' table of the database.
+    The record to be deleted is identified by the provided 'portfolio' and 'id_registro' parameters.
 
     Args:
         id_registro (int): An integer representing the ID of the record to be deleted.
         conexion: The database connection to execute the SQL statement.
+        portfolio (str): The portfolio the record belongs to. Defaults to 'principal'.
 
     Returns:
         None
@@ -171,230 +250,381 @@ def eliminar(id_registro, conexion):
     Raises:
         None
     """
-    sql = f"""DELETE FROM finance
-    WHERE id_registro={id_registro}"""
+    sql = f"""DELETE FROM holdings
+    WHERE portfolio=? AND id_registro={id_registro}"""
 
     try:
-        conexion.cursor.execute(sql)
-        conexion.close()
+        conexion.cursor.execute(sql, (portfolio,))
     except Exception as e:
         print(e.with_traceback)
-        conexion.close()
 
 
-def actualizar(conexion):
-    """Update the current prices of financial records in the database.
+def _fecha_mercado(fecha_ref):
+    """Return the update date assigned to market quotes (stocks/CEDEARs and USD).
 
-    This function updates the current prices of financial records stored in the 'finance' table of the database.
-    It retrieves the latest prices for different types of investments (FCIs, stocks/CEDEARs, USD) and updates
-    the corresponding records in the database.
+    On mondays quotes are stored with friday's date. Otherwise they take the date of the FCI
+    quotes of the run, falling back to yesterday when no FCI was fetched.
 
     Args:
-        conexion: The database connection to execute the SQL statements.
+        fecha_ref (datetime.date): The FCI quote date of the run, or None.
 
     Returns:
-        None
+        datetime.date: The date to store in fecha_upd.
+    """
+    if dt.datetime.today().weekday() == 0:
+        return dt.date.today() - dt.timedelta(days=3)
+    if fecha_ref is not None:
+        return fecha_ref
+    return dt.date.today() - dt.timedelta(days=1)
 
-    Raises:
-        None
+
+def _fecha_fci_vigente():
+    """Return the date of the latest FCI quote published: the last business day before today.
+
+    Returns:
+        datetime.date: The date of the latest FCI quote.
     """
-    url = "https://api.bluelytics.com.ar/v2/latest"
-    res = requests.get(url)
+    fecha = dt.date.today() - dt.timedelta(days=1)
+    while fecha.weekday() >= 5:
+        fecha -= dt.timedelta(days=1)
+    return fecha
 
-    res = json.loads(res.content)
-    valor_usd_actual = res['blue']['value_buy']
 
-    # ------------------------------------------------------------------------------------------------------------------------------------------------------------
-    # --------------------------------------------------------------- FCIs ---------------------------------------------------------------------------------------
-    # ------------------------------------------------------------------------------------------------------------------------------------------------------------
+def corte_vencimiento(source, ahora=None):
+    """Return the fecha_upd below which a holding of a source is stale.
 
-    sql1 = 'SELECT id_registro, ticker, fecha_upd FROM finance WHERE substr(categoria, 1, 1)="1"'
-    sql_jes = 'SELECT id_registro, ticker, fecha_upd FROM finance_jes WHERE substr(categoria, 1, 1)="1"'
-    sql_mama = 'SELECT id_registro, ticker, fecha_upd FROM finance_mama WHERE substr(categoria, 1, 1)="1"'
+    FCIs are stale once a newer daily quote was published. Stocks/CEDEARs and the USD blue rate
+    are always stale during their trading hours, and otherwise only when fecha_upd is older than
+    the date a refresh would store.
 
-    try:
-        conexion.cursor.execute(sql1)
-        lista_fcis = conexion.cursor.fetchall()
+    Args:
+        source (str): The quote source ('fci', 'yf' or 'usd').
+        ahora (datetime.datetime): The reference time. Defaults to now.
 
-        conexion.cursor.execute(sql_jes)
-        lista_fcis.extend(conexion.cursor.fetchall())
+    Returns:
+        str: The cut-off date as 'YYYY-MM-DD', or None if every holding of the source is stale.
+    """
+    ahora = ahora or dt.datetime.now()
 
-        conexion.cursor.execute(sql_mama)
-        lista_fcis.extend(conexion.cursor.fetchall())
+    if source == 'fci':
+        return str(_fecha_fci_vigente())
 
-        for id_registro, ticker, fecha_upd in lista_fcis:
-            tables = pd.read_html(f"https://www.bullmarketbrokers.com/Information/FundData?ticker={ticker}", decimal=',', thousands='.')
+    horario = HORARIO_MERCADO if source == 'yf' else HORARIO_USD
+    if ahora.weekday() < 5 and horario[0] <= ahora.time() <= horario[1]:
+        return None
+    return str(_fecha_mercado(None))
 
-            date_str = tables[1][1][1]
-            valor_actual = tables[1][1][0]
-            date_object_fci = dt.datetime.strptime(date_str, '%d/%m/%Y').date()
 
-            if str(date_object_fci) == str(fecha_upd):
-                print("FCIs ya actualizados")
-                break
+def esta_vencido(source, fecha_upd, ahora=None):
+    """Return whether a holding needs a new quote.
 
-            print(f"ID registro: {id_registro} FCI: {tables[0][1][1]}, valor actual: {valor_actual}, fecha: {date_str}")
+    Args:
+        source (str): The quote source of the holding ('fci', 'yf' or 'usd').
+        fecha_upd (str): The current fecha_upd of the holding.
+        ahora (datetime.datetime): The reference time. Defaults to now.
 
-            if (date_object_fci <= (dt.date.today() - dt.timedelta(days=1))):
-                try:
-                    conexion.cursor.execute(f"""UPDATE finance SET valor_actual={valor_actual}, fecha_upd='{date_object_fci}' WHERE id_registro={id_registro}""")
-                    conexion.cursor.execute(f"""UPDATE finance_jes SET valor_actual={valor_actual}, fecha_upd='{date_object_fci}' WHERE id_registro={id_registro}""")
-                    if id_registro == 125:
-                        print(f"Entra a FCI usd,{valor_actual} * {valor_usd_actual}")
-                        valor_actual = float(valor_actual)*float(valor_usd_actual)
-                        conexion.cursor.execute(f"""UPDATE finance_mama SET valor_actual={valor_actual}, fecha_upd='{date_object_fci}' WHERE id_registro={id_registro}""")
-                    conexion.cursor.execute(f"""UPDATE finance_mama SET valor_actual={valor_actual}, fecha_upd='{date_object_fci}' WHERE id_registro={id_registro}""")
-                except Exception as e:
-                    print("Error fci: ", e)
+    Returns:
+        bool: True if fecha_upd is older than corte_vencimiento of the source.
+    """
+    corte = corte_vencimiento(source, ahora)
+    return corte is None or str(fecha_upd or '')[:10] < corte
 
-    except Exception as e:
-        print("Error fci: ", e)
-        conexion.cerrar()
 
-    # ------------------------------------------------------------------------------------------------------------------------------------------------------------
-    # ---------------------------------------------------------- ACCIONES/CEDEARs --------------------------------------------------------------------------------
-    # ------------------------------------------------------------------------------------------------------------------------------------------------------------
+def planificar_actualizacion(conexion, sources=None, solo_vencidos=False):
+    """Build the distinct-ticker work set of a refresh across every portfolio.
 
-    sql2 = 'SELECT id_registro, ticker FROM finance WHERE substr(categoria, 1, 1)="2" or substr(categoria, 1, 1)="3"'
+    The records of every portfolio are read from 'holdings' in one pass and grouped by the quote
+    they depend on, so a ticker held in several purchases or portfolios is fetched only once. With solo_vencidos the
+    stale holdings are selected in SQL through the fecha_upd index (see migrations) before any
+    network I/O, so fresh tickers are never fetched.
 
-    try:
-        conexion.cursor.execute(sql2)
-        lista_acc = conexion.cursor.fetchall()
-
-        for id_registro, ticker in lista_acc:
-
-            data = yf.download(ticker, period="5d", interval="1d")
-
-            closing_price = data['Close'][len(data) - 1]
-            date_object = data.index[len(data) - 1].to_pydatetime().date()
-
-            if (date_object <= dt.date.today()):
-                try:
-                    if dt.datetime.today().weekday() == 0:
-                        try:
-                            conexion.cursor.execute(f"""UPDATE finance SET valor_actual={closing_price:.2f}, fecha_upd='{dt.date.today() - dt.timedelta(days=3)}' WHERE id_registro={id_registro}""")
-                        except Exception as e:
-                            print("Error acc, cedear: ", e)
-                    else:
-                        if date_object_fci != dt.date.today() - dt.timedelta(days=1):
-                            try:
-                                conexion.cursor.execute(f"""UPDATE finance SET valor_actual={closing_price:.2f}, fecha_upd='{date_object_fci}' WHERE id_registro={id_registro}""")
-                            except Exception as e:
-                                print("Error acc, cedear: ", e)
-                        else:
-                            try:
-                                conexion.cursor.execute(f"""UPDATE finance SET valor_actual={closing_price:.2f}, fecha_upd='{dt.date.today() - dt.timedelta(days=1)}' WHERE id_registro={id_registro}""")
-                            except Exception as e:
-                                print("Error acc, cedear: ", e)
-                except Exception as e:
-                    print(e)
-                    conexion.cerrar()
-    except Exception as e:
-        print(e.with_traceback)
-        conexion.cerrar()
+    Args:
+        conexion: The database connection to execute the SQL statements.
+        sources (iterable): Only plan the holdings of these quote sources. Defaults to all of them.
+        solo_vencidos (bool): Only plan the holdings for which esta_vencido is True.
 
-    # ------------------------------------------------------------------------------------------------------------------------------------------------------------
-    # --------------------------------------------------------------- USDs ---------------------------------------------------------------------------------------
-    # ------------------------------------------------------------------------------------------------------------------------------------------------------------
+    Returns:
+        dict: Maps each (source, ticker) pair to the list of (portfolio, id_registro, fecha_upd)
+        holdings that reference it.
+    """
+    sql = 'SELECT portfolio, id_registro, categoria_cod, ticker, fecha_upd FROM holdings'
+    parametros = ()
+    if solo_vencidos:
+        ahora = dt.datetime.now()
+        cortes = [corte_vencimiento(source, ahora) for source in set(SOURCE_BY_TIPO.values())
+                  if sources is None or source in sources]
+        if cortes and None not in cortes:
+            sql += ' WHERE fecha_upd IS NULL OR fecha_upd < ?'
+            parametros = (max(cortes),)
+
+    plan = {}
+    conexion.cursor.execute(sql, parametros)
+    for portfolio, id_registro, tipo, ticker, fecha_upd in conexion.cursor.fetchall():
+        source = SOURCE_BY_TIPO.get(str(tipo))
+        if source is None or (sources is not None and source not in sources):
+            continue
+        if solo_vencidos and not esta_vencido(source, fecha_upd, ahora):
+            continue
+        key = (source, 'USD') if source == 'usd' else (source, ticker)
+        plan.setdefault(key, []).append((portfolio, id_registro, fecha_upd))
+    return plan
+
+
+def actualizar(conexion, progreso=None, sources=None, solo_vencidos=True, ttl=None):
+    """Update the current prices of financial records in the database.
 
-    sql3 = 'SELECT id_registro, ticker FROM finance WHERE substr(categoria, 1, 1)="4"'
+    This function updates the current prices of the records of every portfolio in the 'holdings' table. It
+    plans the refresh with planificar_actualizacion, fetches each distinct quote once and concurrently through
+    quotes.fetch_all (reusing quote_cache entries within their TTL), and then writes the results with a single
+    executemany. Quotes that could only be served from an older cache entry (quotes.CotizacionEnCache) are not
+    written, so their holdings keep their fecha_upd and stay stale until a fetch succeeds.
+
+    The USD blue rate is requested at most once per call and is the same value used for the USD records
+    and for the conversion of the USD denominated FCI (id_registro 125 of the 'mama' portfolio).
+
+    Args:
+        conexion: The database connection to execute the SQL statements.
+        progreso (callable): Called as progreso(hechos, fallidos, total) while the quotes are fetched. Optional.
+        sources (iterable): Only refresh the holdings of these quote sources. Defaults to all of them.
+        solo_vencidos (bool): Only refresh the holdings whose fecha_upd is stale (see esta_vencido). Defaults to True.
+        ttl (datetime.timedelta): Maximum age of a reused quote_cache entry. Defaults to quotes.CACHE_TTL.
+
+    Returns:
+        None
+
+    Raises:
+        None
+    """
+    nueva_corrida()
 
     try:
-        conexion.cursor.execute(sql3)
-        lista_usd = conexion.cursor.fetchall()
-        url = "https://api.bluelytics.com.ar/v2/latest"
-        res = requests.get(url)
-
-        res = json.loads(res.content)
-        valor_actual = res['blue']['value_buy']
-
-        for id_registro, ticker in lista_usd:
-            if dt.datetime.today().weekday() == 0:
-                try:
-                    conexion.cursor.execute(f"""UPDATE finance SET valor_actual={valor_actual}, fecha_upd='{dt.date.today()  - dt.timedelta(days=3)}' WHERE id_registro={id_registro}""")
-                except Exception as e:
-                    print("Error USD: ", e.with_traceback)
-            else:
-                if date_object_fci != dt.date.today() - dt.timedelta(days=1):
-                    try:
-                        conexion.cursor.execute(f"""UPDATE finance SET valor_actual={valor_actual}, fecha_upd='{date_object_fci}' WHERE id_registro={id_registro}""")
-                    except Exception as e:
-                        print("Error USD: ", e.with_traceback)
-                        conexion.cerrar()
-                else:
-                    try:
-                        conexion.cursor.execute(f"""UPDATE finance SET valor_actual={valor_actual}, fecha_upd='{dt.date.today()  - dt.timedelta(days=1)}' WHERE id_registro={id_registro}""")
-                    except Exception as e:
-                        print("Error USD: ", e.with_traceback)
-                        conexion.cerrar()
+        plan = planificar_actualizacion(conexion, sources=sources, solo_vencidos=solo_vencidos)
     except Exception as e:
-        print("Error fci: ", e.with_traceback)
-        conexion.cerrar()
+        print("Error lectura registros: ", e)
+        return
+
+    jobs = list(plan)
+    if any(source == 'fci' for source, _ in jobs):
+        jobs.insert(0, ('usd', 'USD'))
+    cotizaciones = fetch_all(jobs, cursor=conexion.cursor, ttl=ttl, progreso=progreso)
+
+    valor_usd_actual = cotizaciones.get(('usd', 'USD'))
+    if isinstance(valor_usd_actual, Exception):
+        print("Error USD: ", valor_usd_actual)
+        valor_usd_actual = None
+    elif valor_usd_actual is not None:
+        valor_usd_actual = valor_usd_actual[0]
+
+    fechas_fci = [cotizacion[1] for (source, _), cotizacion in cotizaciones.items()
+                  if source == 'fci' and not isinstance(cotizacion, Exception)]
+    fecha_upd_mercado = _fecha_mercado(max(fechas_fci) if fechas_fci else None)
+
+    updates = []
+
+    for (source, ticker), holdings in plan.items():
+        cotizacion = cotizaciones[(source, ticker)]
+        if isinstance(cotizacion, Exception):
+            print(f"Error {source}: ", ticker, cotizacion)
+            continue
+
+        valor_actual, fecha_cotizacion = cotizacion
+
+        # --------------------------------------------------------------- FCIs ---------------------------------------------------------------------------
+        if source == 'fci':
+            if fecha_cotizacion > dt.date.today() - dt.timedelta(days=1):
+                continue
+            print(f"FCI: {ticker}, valor actual: {valor_actual}, fecha: {fecha_cotizacion}")
+
+            for portfolio, id_registro, fecha_upd in holdings:
+                if str(fecha_cotizacion) == str(fecha_upd):
+                    continue
+                valor = valor_actual
+                if portfolio == 'mama' and id_registro == 125:
+                    if valor_usd_actual is None:
+                        continue
+                    print(f"Entra a FCI usd,{valor_actual} * {valor_usd_actual}")
+                    valor = float(valor_actual)*float(valor_usd_actual)
+                updates.append((valor, str(fecha_cotizacion), portfolio, id_registro))
+
+        # ---------------------------------------------------------- ACCIONES/CEDEARs / USDs -------------------------------------------------------------
+        else:
+            if source == 'yf':
+                if fecha_cotizacion > dt.date.today():
+                    continue
+                valor_actual = round(valor_actual, 2)
+
+            for portfolio, id_registro, _ in holdings:
+                updates.append((valor_actual, str(fecha_upd_mercado), portfolio, id_registro))
+
+    try:
+        conexion.cursor.executemany('UPDATE holdings SET valor_actual=?, fecha_upd=? WHERE portfolio=? AND id_registro=?', updates)
+    except Exception as e:
+        print("Error actualizacion: ", e)
+
+
+def _marcar_historial(conexion):
+    """Bump historial_version once for a write to historical_holdings, so its Arrow copy (see hist_arrow) reads as stale."""
+    conexion.cursor.execute('UPDATE historial_version SET version = version + 1')
 
 
 def appendear_historical(conexion):
-    """Append updated financial records to the historical table.
+    """Write the snapshot of every portfolio to the historical table.
 
-    This function appends the updated financial records from the 'finance' table to the 'historical_finance_invertions'
-    table in the database. It first creates the historical table if it doesn't exist. Then, it deletes the records from
-    the historical table that have the latest update date and are present in the 'finance' table. Finally, it inserts
-    the updated records from the 'finance' table into the historical table.
+    Each record of 'holdings' is upserted into 'historical_holdings' keyed on (portfolio, id_registro,
+    fecha_upd). The latest snapshot date of each record is its high-water mark: records at the same date
+    are rewritten only if a value changed, records with a newer date are inserted, and the rest are not
+    touched. Snapshots of the latest date of a portfolio whose record was deleted are removed. The
+    daily_portfolio_summary and daily_category_summary rows of those dates are then recomputed.
 
     Args:
         conexion: The database connection to execute the SQL statements.
 
     Returns:
-        None
+        int: The number of snapshot rows written.
 
     Raises:
         None
     """
-
-    sql1 = """CREATE TABLE IF NOT EXISTS historical_finance_invertions(
-    id_registro INTEGER,
-    fecha_compra TIMESTAMP,
-    categoria VARCHAR(100),
-    ticker VARCHAR(100),
-    cantidad VARCHAR(100),
-    monto FLOAT,
-    valor_actual FLOAT,
-    fecha_upd TIMESTAMP,
-    PRIMARY KEY(id_registro)
-    )"""
-
+    sql1 = '''INSERT INTO historical_holdings(portfolio, id_registro, fecha_compra, categoria, ticker, cantidad, monto, valor_actual, fecha_upd)
+            SELECT portfolio, id_registro, fecha_compra, categoria, ticker, cantidad, monto, valor_actual, fecha_upd
+            FROM holdings
+            WHERE fecha_upd >= COALESCE((
+                SELECT MAX(fecha_upd)
+                FROM historical_holdings
+                WHERE portfolio = holdings.portfolio AND id_registro = holdings.id_registro
+            ), '')
+            ON CONFLICT(portfolio, id_registro, fecha_upd) DO UPDATE SET
+                fecha_compra = excluded.fecha_compra,
+                categoria = excluded.categoria,
+                ticker = excluded.ticker,
+                cantidad = excluded.cantidad,
+                monto = excluded.monto,
+                valor_actual = excluded.valor_actual
+            WHERE (historical_holdings.fecha_compra, historical_holdings.categoria, historical_holdings.ticker,
+                   historical_holdings.cantidad, historical_holdings.monto, historical_holdings.valor_actual)
+                IS NOT (excluded.fecha_compra, excluded.categoria, excluded.ticker, excluded.cantidad, excluded.monto, excluded.valor_actual)'''
+
+    sql2 = '''DELETE FROM historical_holdings
+            WHERE portfolio = :portfolio
+            AND fecha_upd = (SELECT MAX(fecha_upd) FROM historical_holdings WHERE portfolio = :portfolio)
+            AND id_registro NOT IN (SELECT id_registro FROM holdings WHERE portfolio = :portfolio)'''
+
+    sql3 = '''SELECT DISTINCT portfolio, fecha_upd FROM holdings
+            UNION
+            SELECT portfolio, (SELECT MAX(fecha_upd) FROM historical_holdings AS h WHERE h.portfolio = portfolios.portfolio)
+            FROM portfolios'''
+
+    escritos = 0
     try:
         conexion.cursor.execute(sql1)
+        escritos = conexion.cursor.rowcount
+        conexion.cursor.executemany(sql2, [{'portfolio': portfolio} for portfolio in PORTFOLIOS])
+        if escritos or conexion.cursor.rowcount:
+            _marcar_historial(conexion)
+        conexion.cursor.execute(sql3)
+        _resumir_dias(conexion, [dia for dia in conexion.cursor.fetchall() if dia[1] is not None])
     except Exception as e:
-        print(e.with_traceback)
-        conexion.cerrar()
+        print("Error historico: ", e)
+    return escritos
 
-    sql2 = '''DELETE FROM historical_finance_invertions
-                WHERE fecha_upd = (
-                SELECT MAX(fecha_upd)
-                FROM historical_finance_invertions
-                    WHERE id_registro IN (
-                    SELECT id_registro
-                    FROM finance
-                        WHERE EXISTS (
-                        SELECT 1
-                        FROM historical_finance_invertions
-                            WHERE id_registro = finance.id_registro AND fecha_upd >= finance.fecha_upd
-                        )
-                    )
-                )'''
-
-    sql3 = '''INSERT INTO historical_finance_invertions(id_registro, fecha_compra, categoria, ticker, cantidad, monto, valor_actual, fecha_upd)
-            SELECT id_registro, fecha_compra, categoria, ticker, cantidad, monto, valor_actual, fecha_upd
-            FROM finance
-            WHERE NOT EXISTS (
-                SELECT 1
-                FROM historical_finance_invertions
-                WHERE id_registro = finance.id_registro AND fecha_upd >= finance.fecha_upd
-            )'''
 
+def _resumir_dias(conexion, dias):
+    """Recompute the daily_portfolio_summary and daily_category_summary rows of some (portfolio, fecha_upd) days."""
+    for table, columnas in (('daily_portfolio_summary', 'portfolio, fecha_upd'), ('daily_category_summary', 'portfolio, fecha_upd, categoria')):
+        conexion.cursor.executemany(f'DELETE FROM {table} WHERE portfolio=? AND fecha_upd=?', dias)
+        conexion.cursor.executemany(f'''INSERT INTO {table}({columnas}, monto, monto_actual)
+            SELECT {columnas}, SUM(monto), SUM(valor_actual * CAST(cantidad AS FLOAT))
+            FROM historical_holdings
+            WHERE portfolio=? AND fecha_upd=?
+            GROUP BY {columnas}''', dias)
+
+
+def compactar_historial(conexion, hoy=None):
+    """Downsample the old history of every portfolio to weekly and monthly snapshots.
+
+    For each level of NIVELES_COMPACTACION, the complete periods (weeks or months) older than its
+    age are compacted: each record keeps only its last snapshot of the period, moved to the last
+    snapshot date of the period, also when the record was sold during it. A period then reads as a
+    single snapshot with the last value of every record held in it, so the 'last'-based
+    aggregations of df_def keep their meaning and no date of the period is left with a partial
+    total; a sale shows up in the totals from the next period on. The rollup rows of the dates of
+    the period are recomputed.
+
+    Each compacted period is recorded in historial_compactaciones, whose latest 'hasta' per
+    portfolio and level is the high-water mark of the next run, so only new periods are read.
+    Every period runs in its own savepoint: a period that fails is rolled back whole and the
+    later periods of that portfolio and level wait for the next run, so the mark never skips it.
+
+    Args:
+        conexion: The database connection to execute the SQL statements.
+        hoy (datetime.date): The date the ages are measured from. Defaults to today.
+
+    Returns:
+        list: A (portfolio, nivel, periodo, filas_antes, filas_despues) tuple per period compacted.
+
+    Raises:
+        None
+    """
+    hoy = hoy or dt.date.today()
+    compactados = []
     try:
-        conexion.cursor.execute(sql2)
-        conexion.cursor.execute(sql3)
+        for nivel, dias, formato in NIVELES_COMPACTACION:
+            corte = hoy - dt.timedelta(days=dias)
+            for portfolio in PORTFOLIOS:
+                conexion.cursor.execute('SELECT MAX(hasta) FROM historial_compactaciones WHERE portfolio=? AND nivel=?', (portfolio, nivel))
+                marca = conexion.cursor.fetchone()[0] or ''
+                conexion.cursor.execute('''SELECT DISTINCT fecha_upd FROM historical_holdings
+                    WHERE portfolio=? AND fecha_upd > ? AND fecha_upd < ?
+                    ORDER BY fecha_upd''', (portfolio, marca, str(corte)))
+
+                # The period of the cut-off date is still incomplete.
+                periodos = {}
+                for (fecha,) in conexion.cursor.fetchall():
+                    periodo = dt.date.fromisoformat(fecha[:10]).strftime(formato)
+                    if periodo != corte.strftime(formato):
+                        periodos.setdefault(periodo, []).append(fecha)
+
+                for periodo, fechas in periodos.items():
+                    conexion.cursor.execute('SAVEPOINT compactar_periodo')
+                    try:
+                        compactados.append(_compactar_periodo(conexion, portfolio, nivel, periodo, fechas))
+                    except Exception as e:
+                        print(f"Error compactacion {portfolio} {periodo}: ", e)
+                        conexion.cursor.execute('ROLLBACK TO compactar_periodo')
+                        break
+                    finally:
+                        conexion.cursor.execute('RELEASE compactar_periodo')
     except Exception as e:
-        print(e.with_traceback)
-        conexion.cerrar()
+        print("Error compactacion: ", e)
+    return compactados
+
+
+def _compactar_periodo(conexion, portfolio, nivel, periodo, fechas):
+    """Compact the snapshots of a portfolio on some dates of a period and record it in historial_compactaciones."""
+    parametros = {'portfolio': portfolio, 'desde': fechas[0], 'hasta': fechas[-1]}
+    sql_filas = '''SELECT COUNT(*) FROM historical_holdings
+            WHERE portfolio = :portfolio AND fecha_upd >= :desde AND fecha_upd <= :hasta'''
+
+    conexion.cursor.execute(sql_filas, parametros)
+    filas_antes = conexion.cursor.fetchone()[0]
+
+    if len(fechas) > 1:
+        conexion.cursor.execute('''DELETE FROM historical_holdings
+            WHERE portfolio = :portfolio AND fecha_upd >= :desde AND fecha_upd <= :hasta
+            AND fecha_upd < (
+                SELECT MAX(h.fecha_upd)
+                FROM historical_holdings AS h
+                WHERE h.portfolio = :portfolio AND h.id_registro = historical_holdings.id_registro AND h.fecha_upd <= :hasta
+            )''', parametros)
+        conexion.cursor.execute('''UPDATE historical_holdings SET fecha_upd = :hasta
+            WHERE portfolio = :portfolio AND fecha_upd >= :desde AND fecha_upd < :hasta''', parametros)
+        _resumir_dias(conexion, [(portfolio, fecha) for fecha in fechas])
+        _marcar_historial(conexion)
+
+    conexion.cursor.execute(sql_filas, parametros)
+    filas_despues = conexion.cursor.fetchone()[0]
+
+    conexion.cursor.execute('''INSERT INTO historial_compactaciones(portfolio, nivel, periodo, desde, hasta, fechas, filas_antes, filas_despues, compactado)
+        VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+        (portfolio, nivel, periodo, fechas[0], fechas[-1], len(fechas), filas_antes, filas_despues, dt.datetime.now().isoformat(timespec='seconds')))
+    return portfolio, nivel, periodo, filas_antes, filas_despues
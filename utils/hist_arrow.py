@@ -0,0 +1,145 @@
+import os
+import pandas as pd
+try:
+    from df_def import tipar_historial
+except:
+    from utils.df_def import tipar_historial
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.ipc as ipc
+except ImportError:
+    pa = None
+
+
+# Columns of the history as returned by db_conn.custom_query_resume, in order.
+COLUMNAS = ['id_registro', 'fecha_compra', 'categoria', 'ticker', 'cantidad', 'monto', 'valor_actual', 'fecha_upd',
+            'monto_actual', 'diferencia', 'gan%']
+
+# Columns scaled by the divider of the dashboards.
+COLUMNAS_DIVIDIDAS = ['cantidad', 'monto', 'monto_actual', 'diferencia']
+
+
+def disponible():
+    """Return whether pyarrow is installed, which the Arrow copy of the history needs."""
+    return pa is not None
+
+
+def ruta_historial(base_datos):
+    """Return the path of the Arrow copy of the history of a database.
+
+    Args:
+        base_datos (str): The file path of the SQLite database.
+
+    Returns:
+        str: The ST_HIST_ARROW environment variable, or a file next to the database.
+    """
+    return os.environ.get('ST_HIST_ARROW') or os.path.splitext(base_datos)[0] + '_historical.arrow'
+
+
+def version_historial(cursor):
+    """Return the write counter of historical_holdings, bumped by functions._marcar_historial.
+
+    Args:
+        cursor: A cursor object of the database.
+
+    Returns:
+        int: The current version of the history.
+    """
+    cursor.execute('SELECT version FROM historial_version')
+    return cursor.fetchone()[0]
+
+
+def exportar_historial(conexion):
+    """Write the history of every portfolio, with its derived columns, to an Arrow IPC file.
+
+    The file holds historical_holdings plus monto_actual, diferencia and gan%, undivided, sorted
+    like custom_query_resume within each portfolio, and the version of the history it was read
+    at. It is uncompressed so that cargar_historial can memory-map it, and it is replaced
+    atomically. Meant to run after appendear_historical; it reads through the same connection, so
+    it sees the writes of the caller's transaction, which is left for the caller to commit.
+
+    Args:
+        conexion: The database connection (conexionDB) to read the history from.
+
+    Returns:
+        str: The path of the file written, or None if pyarrow is not installed or the export failed.
+    """
+    if pa is None:
+        return None
+
+    ruta = ruta_historial(conexion.base_datos)
+    temporal = f'{ruta}.{os.getpid()}.tmp'
+    try:
+        # Read before the rows, so a write in between leaves the file stale rather than wrongly current.
+        version = version_historial(conexion.cursor)
+        df = pd.read_sql_query('''
+            SELECT portfolio, id_registro, fecha_compra, categoria, ticker,
+            CAST(cantidad AS FLOAT) AS cantidad, monto, valor_actual, fecha_upd
+            FROM historical_holdings
+            ORDER BY portfolio, fecha_upd desc, id_registro desc
+        ''', conexion.conexion)
+        df['monto_actual'] = df['valor_actual'] * df['cantidad']
+        df['diferencia'] = df['monto_actual'] - df['monto']
+        df['gan%'] = df['diferencia'] / df['monto'] * 100
+
+        tabla = pa.Table.from_pandas(df, preserve_index=False)
+        tabla = tabla.replace_schema_metadata({'version': str(version)})
+        with pa.OSFile(temporal, 'wb') as destino, ipc.new_file(destino, tabla.schema) as escritor:
+            escritor.write_table(tabla)
+        os.replace(temporal, ruta)
+        return ruta
+    except Exception as e:
+        print("Error exportacion historico: ", e)
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        return None
+
+
+def cargar_historial(conexion, divider, portfolio='principal', desde=None, hasta=None):
+    """Load the history of a portfolio from its Arrow copy.
+
+    The file is memory-mapped and filtered with pyarrow before the conversion to pandas, so only
+    the rows of the portfolio and date range are materialized. The map is closed before returning,
+    so the next export can replace the file. Returns None, for the caller to
+    read SQLite instead, if pyarrow is not installed, the file doesn't exist, or it has no version or
+    not the current one of the history.
+
+    Args:
+        conexion: The database connection (conexionDB) whose history the file copies.
+        divider (int): A number to divide the quantity and amounts for summarization.
+        portfolio (str): The portfolio key, or None for the records of every portfolio together.
+        desde (str): Lower bound of fecha_upd, inclusive. Optional.
+        hasta (str): Upper bound of fecha_upd, exclusive. Optional.
+
+    Returns:
+        DataFrame: The history, like the df_hist of custom_query_resume and with its dtypes, or None.
+    """
+    if pa is None:
+        return None
+
+    ruta = ruta_historial(conexion.base_datos)
+    try:
+        # The filter and to_pandas copy the rows out of the map, so nothing references it once closed.
+        with pa.memory_map(ruta) as fuente:
+            tabla = ipc.open_file(fuente).read_all()
+            # A file without the version, not written by exportar_historial, is taken as stale.
+            version = (tabla.schema.metadata or {}).get(b'version')
+            if version is None or version != str(version_historial(conexion.cursor)).encode():
+                return None
+
+            filtro = pc.greater_equal(tabla['fecha_upd'], desde or '')
+            if hasta is not None:
+                filtro = pc.and_(filtro, pc.less(tabla['fecha_upd'], hasta))
+            if portfolio is not None:
+                filtro = pc.and_(filtro, pc.equal(tabla['portfolio'], portfolio))
+            tabla = tabla.filter(filtro)
+            if portfolio is None:
+                tabla = tabla.sort_by([('fecha_upd', 'descending'), ('id_registro', 'descending')])
+
+            df_hist = tabla.select(COLUMNAS).to_pandas()
+    except (FileNotFoundError, pa.ArrowInvalid):
+        return None
+
+    df_hist[COLUMNAS_DIVIDIDAS] = df_hist[COLUMNAS_DIVIDIDAS] / divider
+    return tipar_historial(df_hist)
@@ -0,0 +1,271 @@
+import datetime as dt
+
+
+# Portfolio keys, with the suffix of the per-portfolio tables they had before migration 4.
+PORTFOLIOS = {
+    'principal': '',
+    'jes': '_jes',
+    'mama': '_mama'
+    }
+
+# Legacy tables holding the current records and the history of each portfolio. Since migration 4
+# they are views over 'holdings' and 'historical_holdings'.
+TABLAS_FINANCE = tuple(f'finance{sufijo}' for sufijo in PORTFOLIOS.values())
+TABLAS_HISTORICAL = tuple(f'historical_finance_invertions{sufijo}' for sufijo in PORTFOLIOS.values())
+
+COLUMNAS_REGISTRO = 'id_registro, fecha_compra, categoria, ticker, cantidad, monto, valor_actual, fecha_upd'
+
+
+def _existe(cursor, table):
+    """Return whether a table exists in the database."""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,))
+    return cursor.fetchone() is not None
+
+
+def _columnas(cursor, table):
+    """Return the column names of a table, generated columns included."""
+    cursor.execute(f'PRAGMA table_xinfo({table})')
+    return [fila[1] for fila in cursor.fetchall()]
+
+
+def _m001_categoria_cod(cursor):
+    """Add the categoria_cod column, the leading digit of 'categoria', to every finance table.
+
+    It is a virtual generated column, so it stays in sync with 'categoria' without triggers and
+    can be indexed in place of substr(categoria, 1, 1).
+    """
+    for table in TABLAS_FINANCE + TABLAS_HISTORICAL:
+        if _existe(cursor, table) and 'categoria_cod' not in _columnas(cursor, table):
+            cursor.execute(f'''ALTER TABLE {table} ADD COLUMN categoria_cod INTEGER
+                GENERATED ALWAYS AS (CAST(substr(categoria, 1, 1) AS INTEGER)) VIRTUAL''')
+
+
+def _m003_snapshot_unico(cursor):
+    """Make (id_registro, fecha_upd) the unique key of every historical table.
+
+    appendear_historical upserts snapshots on that key. Duplicated snapshots are removed keeping
+    the last one written, and a unique (id_registro, fecha_upd) index is created. A table created with PRIMARY KEY(id_registro), which holds a single snapshot
+    per record, is rebuilt with the composite key.
+    """
+    reconstruidas = False
+    for table in TABLAS_HISTORICAL:
+        if not _existe(cursor, table):
+            continue
+
+        cursor.execute(f'PRAGMA table_info({table})')
+        if [fila[1] for fila in sorted(cursor.fetchall(), key=lambda fila: fila[5]) if fila[5]] == ['id_registro']:
+            columnas = 'id_registro, fecha_compra, categoria, ticker, cantidad, monto, valor_actual, fecha_upd'
+            cursor.execute(f'ALTER TABLE {table} RENAME TO {table}_m003')
+            cursor.execute(f'''CREATE TABLE {table}(
+                id_registro INTEGER,
+                fecha_compra TIMESTAMP,
+                categoria VARCHAR(100),
+                ticker VARCHAR(100),
+                cantidad VARCHAR(100),
+                monto FLOAT,
+                valor_actual FLOAT,
+                fecha_upd TIMESTAMP,
+                PRIMARY KEY(id_registro, fecha_upd)
+                )''')
+            cursor.execute(f'INSERT INTO {table}({columnas}) SELECT {columnas} FROM {table}_m003')
+            cursor.execute(f'DROP TABLE {table}_m003')
+            reconstruidas = True
+            continue
+
+        cursor.execute(f'''DELETE FROM {table} WHERE rowid NOT IN (
+            SELECT MAX(rowid) FROM {table} GROUP BY id_registro, fecha_upd)''')
+        cursor.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS ux_{table}_id_fecha ON {table}(id_registro, fecha_upd)')
+
+    if reconstruidas:
+        # The rebuilt tables lost the generated column; the primary key already covers (id_registro, fecha_upd).
+        _m001_categoria_cod(cursor)
+
+
+def _m004_portfolios(cursor):
+    """Move every portfolio to the 'holdings' and 'historical_holdings' tables, keyed by 'portfolio'.
+
+    The records keep their id_registro, which is now unique per portfolio; 'portfolios' keeps the
+    last id given in each one, like sqlite_sequence did for the AUTOINCREMENT tables. The legacy
+    tables are replaced by views with the same name and columns, and the finance views accept
+    INSERT, UPDATE and DELETE through INSTEAD OF triggers.
+    """
+    cursor.execute('''CREATE TABLE IF NOT EXISTS portfolios(
+        portfolio VARCHAR(20) PRIMARY KEY,
+        ultimo_id INTEGER NOT NULL DEFAULT 0
+        )''')
+    for tabla, clave in (('holdings', 'portfolio, id_registro'), ('historical_holdings', 'portfolio, id_registro, fecha_upd')):
+        cursor.execute(f'''CREATE TABLE IF NOT EXISTS {tabla}(
+            portfolio VARCHAR(20) NOT NULL,
+            id_registro INTEGER NOT NULL,
+            fecha_compra TIMESTAMP,
+            categoria VARCHAR(100),
+            ticker VARCHAR(100),
+            cantidad VARCHAR(100),
+            monto FLOAT,
+            valor_actual FLOAT,
+            fecha_upd TIMESTAMP,
+            categoria_cod INTEGER GENERATED ALWAYS AS (CAST(substr(categoria, 1, 1) AS INTEGER)) VIRTUAL,
+            PRIMARY KEY({clave})
+            )''')
+
+    secuencias = _existe(cursor, 'sqlite_sequence')
+    for portfolio, sufijo in PORTFOLIOS.items():
+        finance = f'finance{sufijo}'
+        historical = f'historical_finance_invertions{sufijo}'
+
+        ultimo_id = 0
+        if _existe(cursor, finance):
+            cursor.execute(f'INSERT INTO holdings(portfolio, {COLUMNAS_REGISTRO}) SELECT ?, {COLUMNAS_REGISTRO} FROM {finance}', (portfolio,))
+            cursor.execute(f'SELECT COALESCE(MAX(id_registro), 0) FROM {finance}')
+            ultimo_id = cursor.fetchone()[0]
+            if secuencias:
+                cursor.execute('SELECT seq FROM sqlite_sequence WHERE name=?', (finance,))
+                fila = cursor.fetchone()
+                ultimo_id = max(ultimo_id, fila[0] if fila else 0)
+            cursor.execute(f'DROP TABLE {finance}')
+        cursor.execute('INSERT OR IGNORE INTO portfolios(portfolio, ultimo_id) VALUES(?, ?)', (portfolio, ultimo_id))
+
+        if _existe(cursor, historical):
+            cursor.execute(f'INSERT OR IGNORE INTO historical_holdings(portfolio, {COLUMNAS_REGISTRO}) SELECT ?, {COLUMNAS_REGISTRO} FROM {historical}', (portfolio,))
+            cursor.execute(f'DROP TABLE {historical}')
+
+        cursor.execute(f"CREATE VIEW IF NOT EXISTS {finance} AS SELECT {COLUMNAS_REGISTRO} FROM holdings WHERE portfolio = '{portfolio}'")
+        cursor.execute(f"CREATE VIEW IF NOT EXISTS {historical} AS SELECT {COLUMNAS_REGISTRO} FROM historical_holdings WHERE portfolio = '{portfolio}'")
+
+        cursor.execute(f'''CREATE TRIGGER IF NOT EXISTS {finance}_insert INSTEAD OF INSERT ON {finance}
+            BEGIN
+                UPDATE portfolios SET ultimo_id = MAX(ultimo_id + 1, COALESCE(NEW.id_registro, 0)) WHERE portfolio = '{portfolio}';
+                INSERT INTO holdings(portfolio, {COLUMNAS_REGISTRO})
+                VALUES('{portfolio}', COALESCE(NEW.id_registro, (SELECT ultimo_id FROM portfolios WHERE portfolio = '{portfolio}')),
+                       NEW.fecha_compra, NEW.categoria, NEW.ticker, NEW.cantidad, NEW.monto, NEW.valor_actual, NEW.fecha_upd);
+            END''')
+        cursor.execute(f'''CREATE TRIGGER IF NOT EXISTS {finance}_update INSTEAD OF UPDATE ON {finance}
+            BEGIN
+                UPDATE holdings SET id_registro = NEW.id_registro, fecha_compra = NEW.fecha_compra, categoria = NEW.categoria,
+                    ticker = NEW.ticker, cantidad = NEW.cantidad, monto = NEW.monto, valor_actual = NEW.valor_actual, fecha_upd = NEW.fecha_upd
+                WHERE portfolio = '{portfolio}' AND id_registro = OLD.id_registro;
+            END''')
+        cursor.execute(f'''CREATE TRIGGER IF NOT EXISTS {finance}_delete INSTEAD OF DELETE ON {finance}
+            BEGIN
+                DELETE FROM holdings WHERE portfolio = '{portfolio}' AND id_registro = OLD.id_registro;
+            END''')
+
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_holdings_fecha_upd ON holdings(fecha_upd)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_holdings_cat_ticker ON holdings(categoria_cod, ticker, fecha_upd, portfolio, id_registro)')
+    # Finds and orders the rows of a portfolio and date range for the history reads; the rows come from the table.
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_historical_holdings_fecha ON historical_holdings(portfolio, fecha_upd, id_registro)')
+
+
+def _m005_resumenes_diarios(cursor):
+    """Create the daily_portfolio_summary and daily_category_summary rollups of historical_holdings.
+
+    They hold, per portfolio and fecha_upd (and categoria), the sums of monto and of valor_actual *
+    cantidad, undivided. appendear_historical keeps them up to date for the days it writes; this
+    migration fills them from the existing history.
+    """
+    cursor.execute('''CREATE TABLE IF NOT EXISTS daily_portfolio_summary(
+        portfolio VARCHAR(20) NOT NULL,
+        fecha_upd TIMESTAMP NOT NULL,
+        monto FLOAT,
+        monto_actual FLOAT,
+        PRIMARY KEY(portfolio, fecha_upd)
+        )''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS daily_category_summary(
+        portfolio VARCHAR(20) NOT NULL,
+        fecha_upd TIMESTAMP NOT NULL,
+        categoria VARCHAR(100) NOT NULL,
+        monto FLOAT,
+        monto_actual FLOAT,
+        PRIMARY KEY(portfolio, fecha_upd, categoria)
+        )''')
+
+    cursor.execute('''INSERT OR REPLACE INTO daily_portfolio_summary(portfolio, fecha_upd, monto, monto_actual)
+        SELECT portfolio, fecha_upd, SUM(monto), SUM(valor_actual * CAST(cantidad AS FLOAT))
+        FROM historical_holdings
+        GROUP BY portfolio, fecha_upd''')
+    cursor.execute('''INSERT OR REPLACE INTO daily_category_summary(portfolio, fecha_upd, categoria, monto, monto_actual)
+        SELECT portfolio, fecha_upd, categoria, SUM(monto), SUM(valor_actual * CAST(cantidad AS FLOAT))
+        FROM historical_holdings
+        GROUP BY portfolio, fecha_upd, categoria''')
+
+
+def _m006_version_historial(cursor):
+    """Count the writes to historical_holdings in historial_version.
+
+    The writers of the history (appendear_historical and the compaction) bump the counter once per
+    write through functions._marcar_historial, so a copy of the history taken at a given version
+    (see hist_arrow) can tell whether it is still current.
+    """
+    cursor.execute('CREATE TABLE IF NOT EXISTS historial_version(version INTEGER NOT NULL)')
+    cursor.execute('INSERT INTO historial_version(version) SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM historial_version)')
+
+
+def _m007_compactaciones(cursor):
+    """Create historial_compactaciones, the audit of the periods compacted by functions.compactar_historial."""
+    cursor.execute('''CREATE TABLE IF NOT EXISTS historial_compactaciones(
+        id_compactacion INTEGER PRIMARY KEY AUTOINCREMENT,
+        portfolio VARCHAR(20) NOT NULL,
+        nivel VARCHAR(20) NOT NULL,
+        periodo VARCHAR(20) NOT NULL,
+        desde TIMESTAMP,
+        hasta TIMESTAMP,
+        fechas INTEGER,
+        filas_antes INTEGER,
+        filas_despues INTEGER,
+        compactado TIMESTAMP,
+        UNIQUE(portfolio, nivel, periodo)
+        )''')
+
+
+# Ordered list of (version, description, migration). Applied migrations are recorded in the
+# schema_migrations table; new ones must be appended with the next version number. Version 2,
+# indexes on the legacy tables that migration 4 drops, was removed before release.
+MIGRACIONES = [
+    (1, 'categoria_cod en tablas de finanzas', _m001_categoria_cod),
+    (3, 'clave unica de snapshots historicos', _m003_snapshot_unico),
+    (4, 'tablas holdings e historical_holdings por portfolio', _m004_portfolios),
+    (5, 'resumenes diarios por portfolio y categoria', _m005_resumenes_diarios),
+    (6, 'contador de escrituras del historico', _m006_version_historial),
+    (7, 'auditoria de compactacion del historico', _m007_compactaciones),
+]
+
+
+def migrar(conexion):
+    """Apply the pending migrations to a database.
+
+    Each migration runs in its own immediate transaction and is recorded in schema_migrations, so
+    calling this on every startup is idempotent and safe with several processes. If a migration
+    fails it is rolled back and the later ones are not applied.
+
+    Args:
+        conexion: A SQLite connection object.
+
+    Returns:
+        list: The versions applied by this call.
+    """
+    cursor = conexion.cursor()
+    cursor.execute('''CREATE TABLE IF NOT EXISTS schema_migrations(
+    version INTEGER PRIMARY KEY,
+    descripcion VARCHAR(100),
+    aplicada TIMESTAMP
+    )''')
+    conexion.commit()
+
+    aplicadas = []
+    for version, descripcion, migracion in MIGRACIONES:
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('SELECT 1 FROM schema_migrations WHERE version=?', (version,))
+            if cursor.fetchone() is not None:
+                conexion.rollback()
+                continue
+            migracion(cursor)
+            cursor.execute('INSERT INTO schema_migrations(version, descripcion, aplicada) VALUES(?, ?, ?)',
+                           (version, descripcion, dt.datetime.now().isoformat(timespec='seconds')))
+            conexion.commit()
+            aplicadas.append(version)
+        except Exception as e:
+            print(f"Error migracion {version} ({descripcion}): ", e)
+            conexion.rollback()
+            break
+    return aplicadas
@@ -0,0 +1,695 @@
+import pandas as pd
+import datetime as dt
+import yfinance as yf
+import requests
+import ast
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from io import StringIO
+from html.parser import HTMLParser
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+
+FCI_URL = os.environ.get('ST_FCI_URL', "https://www.bullmarketbrokers.com/Information/FundData?ticker={ticker}")
+USD_URL = os.environ.get('ST_USD_URL', "https://api.bluelytics.com.ar/v2/latest")
+
+# Maximum number of simultaneous requests against each source.
+MAX_CONCURRENCIA = {
+    'fci': 8,
+    'yf': 4,
+    'usd': 1
+    }
+
+# Requests per source are spaced at least INTERVALO_MINIMO seconds apart.
+INTERVALO_MINIMO = {
+    'fci': 0.05,
+    'yf': 0.5,
+    'usd': 0.0
+    }
+
+# (connect, read) timeout in seconds of every request.
+TIMEOUT = (float(os.environ.get('ST_HTTP_CONNECT_TIMEOUT', 5)), float(os.environ.get('ST_HTTP_READ_TIMEOUT', 20)))
+
+# Transient failures are retried REINTENTOS times with exponential backoff starting at BACKOFF seconds.
+REINTENTOS = 2
+BACKOFF = 0.5
+
+# After UMBRAL_FALLOS consecutive transient failures a source is skipped for ENFRIAMIENTO.
+UMBRAL_FALLOS = 3
+ENFRIAMIENTO = dt.timedelta(minutes=2)
+
+# Quotes cached in the quote_cache table are reused for CACHE_TTL and evicted after CACHE_RETENTION.
+CACHE_TTL = dt.timedelta(minutes=int(os.environ.get('ST_QUOTE_TTL_MIN', 60)))
+CACHE_RETENTION = dt.timedelta(days=int(os.environ.get('ST_QUOTE_RETENTION_DAYS', 7)))
+
+
+_sesiones = {}
+_sesiones_lock = threading.Lock()
+
+_usd_blue = {}
+_usd_blue_lock = threading.Lock()
+
+_limitadores = {}
+_breakers = {}
+_control_lock = threading.Lock()
+
+
+class FuenteNoDisponible(Exception):
+    """Raised instead of fetching while the circuit breaker of a source is open."""
+
+
+class ErrorTransitorio(Exception):
+    """A transient failure (timeout, connection error or rate limit) that a library reported without raising it."""
+
+
+class CotizacionEnCache(Exception):
+    """Returned by fetch_all instead of the error of a failed fetch when the quote was cached before.
+
+    It is still a failure, so the refresh doesn't stamp an old price with today's date; callers that
+    can use an old price read it, with its own quote date, from 'cotizacion'.
+
+    Attributes:
+        cotizacion (tuple): The last cached price and its quote date (datetime.date).
+        error (Exception): The error of the failed fetch.
+    """
+
+    def __init__(self, cotizacion, error):
+        super().__init__(f"ultima cotizacion en cache del {cotizacion[1]}: {error}")
+        self.cotizacion = cotizacion
+        self.error = error
+
+
+class LimitadorAdaptativo:
+    """Rate limiter with adaptive concurrency for one quote source.
+
+    At most 'limite' requests are in flight, started at least 'intervalo' seconds apart. The limit
+    grows by one after each success up to 'maximo' and is halved after each transient failure.
+
+    Attributes:
+        maximo (int): The maximum concurrency.
+        limite (int): The current concurrency.
+        intervalo (float): Minimum seconds between two request starts.
+    """
+
+    def __init__(self, maximo, intervalo):
+        """Initialize the limiter at its maximum concurrency."""
+        self.maximo = maximo
+        self.limite = maximo
+        self.intervalo = intervalo
+        self.en_vuelo = 0
+        self.proximo = 0.0
+        self.condicion = threading.Condition()
+
+    def adquirir(self):
+        """Block until a new request may start."""
+        with self.condicion:
+            while True:
+                if self.en_vuelo >= self.limite:
+                    self.condicion.wait()
+                    continue
+                espera = self.proximo - time.monotonic()
+                if espera <= 0:
+                    break
+                self.condicion.wait(espera)
+            self.en_vuelo += 1
+            self.proximo = time.monotonic() + self.intervalo
+
+    def liberar(self, exito):
+        """Release a request slot, adapting the concurrency to its outcome."""
+        with self.condicion:
+            self.en_vuelo -= 1
+            if exito:
+                self.limite = min(self.maximo, self.limite + 1)
+            else:
+                self.limite = max(1, self.limite // 2)
+            self.condicion.notify_all()
+
+
+class CircuitBreaker:
+    """Circuit breaker for one quote source.
+
+    After 'umbral' consecutive transient failures the circuit opens and the source is skipped for
+    'enfriamiento'. Then a single trial request is let through: a success closes the circuit, a
+    failure opens it again.
+    """
+
+    def __init__(self, umbral, enfriamiento):
+        """Initialize a closed circuit."""
+        self.umbral = umbral
+        self.enfriamiento = enfriamiento
+        self.fallos = 0
+        self.abierto_hasta = None
+        self.lock = threading.Lock()
+
+    def permitir(self):
+        """Return whether a request may be sent to the source."""
+        with self.lock:
+            if self.abierto_hasta is None:
+                return True
+            ahora = dt.datetime.now()
+            if ahora < self.abierto_hasta:
+                return False
+            self.abierto_hasta = ahora + self.enfriamiento
+            return True
+
+    def registrar(self, exito):
+        """Record the outcome of a request."""
+        with self.lock:
+            if exito:
+                self.fallos = 0
+                self.abierto_hasta = None
+                return
+            self.fallos += 1
+            if self.fallos >= self.umbral:
+                self.abierto_hasta = dt.datetime.now() + self.enfriamiento
+
+
+def _control(source):
+    """Return the process-wide limiter and circuit breaker of a source."""
+    with _control_lock:
+        if source not in _limitadores:
+            _limitadores[source] = LimitadorAdaptativo(MAX_CONCURRENCIA[source], INTERVALO_MINIMO.get(source, 0.0))
+            _breakers[source] = CircuitBreaker(UMBRAL_FALLOS, ENFRIAMIENTO)
+        return _limitadores[source], _breakers[source]
+
+
+def _es_transitorio(error):
+    """Return whether an error is worth retrying: a timeout, a connection error, a 429 or a 5xx."""
+    if isinstance(error, requests.HTTPError):
+        return error.response is not None and (error.response.status_code == 429 or error.response.status_code >= 500)
+    return isinstance(error, (ErrorTransitorio, requests.ConnectionError, requests.Timeout, TimeoutError, ConnectionError))
+
+
+def _llamar(source, fetcher, argumento):
+    """Call a fetcher through the limiter, circuit breaker and retry budget of its source.
+
+    Batch fetchers count as failed when every ticker of the batch failed with a transient error;
+    other per-ticker errors are returned in the batch result, like a success.
+
+    Args:
+        source (str): The quote source.
+        fetcher (callable): A FETCHERS or BATCH_FETCHERS function.
+        argumento: The ticker, or list of tickers, passed to the fetcher.
+
+    Returns:
+        The fetcher result.
+
+    Raises:
+        FuenteNoDisponible: If the circuit breaker of the source is open.
+        Exception: The last error of the fetcher.
+    """
+    limitador, breaker = _control(source)
+
+    resultado = None
+    for intento in range(REINTENTOS + 1):
+        if not breaker.permitir():
+            raise FuenteNoDisponible(f"{source} no disponible, circuito abierto")
+
+        limitador.adquirir()
+        try:
+            resultado = fetcher(argumento)
+            error = None
+            transitorio = False
+            errores = list(resultado.values()) if isinstance(resultado, dict) else []
+            # A batch only failed as a whole if every ticker failed for a transient reason.
+            if errores and all(isinstance(r, Exception) and _es_transitorio(r) for r in errores):
+                error = errores[0]
+                transitorio = True
+        except Exception as e:
+            error = e
+            transitorio = _es_transitorio(e)
+        limitador.liberar(not transitorio)
+
+        if error is None or not transitorio:
+            breaker.registrar(True)
+            if error is not None:
+                raise error
+            return resultado
+
+        breaker.registrar(False)
+        if intento < REINTENTOS:
+            time.sleep(BACKOFF * 2 ** intento * (1 + random.random()))
+
+    if isinstance(resultado, dict):
+        return resultado
+    raise error
+
+
+def get_session(url):
+    """Return the pooled requests.Session of the host of an url.
+
+    Sessions are created once per host and shared by every thread, so consecutive requests reuse
+    their keep-alive connections.
+
+    Args:
+        url (str): The url to request.
+
+    Returns:
+        requests.Session: The session of the url host.
+    """
+    host = urlsplit(url).netloc
+    with _sesiones_lock:
+        if host not in _sesiones:
+            sesion = requests.Session()
+            pool = max(MAX_CONCURRENCIA.values())
+            sesion.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=pool))
+            _sesiones[host] = sesion
+        return _sesiones[host]
+
+
+def nueva_corrida():
+    """Start a new refresh run, forgetting the USD blue rate memoized by the previous one.
+
+    Returns:
+        None
+    """
+    with _usd_blue_lock:
+        _usd_blue.clear()
+
+
+def usd_blue():
+    """Return the USD blue buy rate of the current run.
+
+    The rate is requested to bluelytics only the first time it is needed after nueva_corrida; every
+    later call of the run reads the memoized value.
+
+    Returns:
+        tuple: The blue buy rate and its date (datetime.date).
+    """
+    with _usd_blue_lock:
+        if 'valor' not in _usd_blue:
+            res = get_session(USD_URL).get(USD_URL, timeout=TIMEOUT)
+            res.raise_for_status()
+
+            res = json.loads(res.content)
+            _usd_blue['valor'] = (res['blue']['value_buy'], dt.date.today())
+        return _usd_blue['valor']
+
+
+class _Listo(Exception):
+    """Raised by _FciPageParser to stop parsing once the quote cells were read."""
+
+
+class _FciPageParser(HTMLParser):
+    """Read the text of the quote cells of a bullmarket FundData page.
+
+    The price and date are the second cell of the first two data rows of the second table of the
+    page, the same cells read through pd.read_html as tables[1][1][0] and tables[1][1][1]. Like
+    read_html, tables without any cell are not counted, and rows inside <thead> and rows made only
+    of <th> cells before the data are kept apart as headers, for parse_fci_page to check the shape.
+    """
+
+    TABLA = 1
+    COLUMNA = 1
+    FILAS = 2
+
+    def __init__(self):
+        super().__init__()
+        self.tabla = -1
+        self.contada = False
+        self.en_thead = False
+        self.fila = None
+        self.celda = None
+        self.solo_th = True
+        self.encabezados = []
+        self.filas = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'table':
+            self.contada = False
+        elif tag == 'thead':
+            self.en_thead = True
+        elif tag == 'tr':
+            self.fila = []
+            self.solo_th = True
+        elif tag in ('td', 'th') and self.fila is not None:
+            self.solo_th = self.solo_th and tag == 'th'
+            self.celda = []
+
+    def handle_endtag(self, tag):
+        if tag == 'thead':
+            self.en_thead = False
+        elif tag in ('td', 'th') and self.celda is not None:
+            self.fila.append(' '.join(''.join(self.celda).split()))
+            self.celda = None
+        elif tag == 'tr' and self.fila is not None:
+            # A table counts from its first row with cells, so empty tables don't shift the index.
+            if self.fila and not self.contada:
+                self.tabla += 1
+                self.contada = True
+            if self.fila and self.tabla == self.TABLA:
+                if self.en_thead or (self.solo_th and not self.filas):
+                    self.encabezados.append(self.fila)
+                else:
+                    self.filas.append(self.fila)
+            self.fila = None
+            if len(self.filas) == self.FILAS:
+                raise _Listo()
+        elif tag == 'table' and self.contada and self.tabla == self.TABLA:
+            raise _Listo()
+
+    def handle_data(self, data):
+        if self.celda is not None:
+            self.celda.append(data)
+
+
+def parse_fci_page(html):
+    """Parse the price and date of a bullmarket FundData page without building DataFrames.
+
+    Args:
+        html (str): The HTML of the page.
+
+    Returns:
+        tuple: The current value (float) and the quote date (datetime.date).
+
+    Raises:
+        ValueError: If the page doesn't hold the expected quote cells, or the quote table has a header or
+            short rows, so that its layout may have changed.
+    """
+    parser = _FciPageParser()
+    try:
+        parser.feed(html)
+    except _Listo:
+        pass
+
+    if len(parser.filas) < parser.FILAS:
+        raise ValueError("Pagina de FCI sin cotizacion")
+    # read_html would name the columns after a header and pad short rows, so tables[1][1] would not hold the quote.
+    if parser.encabezados or any(len(fila) <= parser.COLUMNA for fila in parser.filas):
+        raise ValueError("Tabla de cotizacion de FCI con otro formato")
+
+    valor_str, date_str = (fila[parser.COLUMNA] for fila in parser.filas)
+    valor_actual = float(valor_str.replace('.', '').replace(',', '.'))
+    return valor_actual, dt.datetime.strptime(date_str, '%d/%m/%Y').date()
+
+
+def parse_fci_page_read_html(html):
+    """Parse the price and date of a bullmarket FundData page through pd.read_html.
+
+    Args:
+        html (str): The HTML of the page.
+
+    Returns:
+        tuple: The current value (float) and the quote date (datetime.date).
+
+    Raises:
+        ValueError: If the quote cell is empty.
+    """
+    tables = pd.read_html(StringIO(html), decimal=',', thousands='.')
+
+    valor_actual = float(tables[1][1][0])
+    if pd.isna(valor_actual):
+        raise ValueError("Pagina de FCI sin cotizacion")
+    date_str = tables[1][1][1]
+    return valor_actual, dt.datetime.strptime(date_str, '%d/%m/%Y').date()
+
+
+def fetch_fci(ticker):
+    """Fetch the current quote of a FCI from bullmarketbrokers.
+
+    The page is parsed with parse_fci_page, falling back to pd.read_html if its layout changed.
+
+    Args:
+        ticker (str): The ticker symbol of the fund.
+
+    Returns:
+        tuple: The current value and the quote date (datetime.date).
+    """
+    url = FCI_URL.format(ticker=ticker)
+    res = get_session(url).get(url, timeout=TIMEOUT)
+    res.raise_for_status()
+    html = res.text
+
+    try:
+        return parse_fci_page(html)
+    except ValueError:
+        return parse_fci_page_read_html(html)
+
+
+# Errors that yf.download logs for a ticker instead of raising, which are worth retrying.
+_ERRORES_TRANSITORIOS_YF = re.compile(r'RateLimit|Too Many Requests|\b429\b|Timeout|timed out|DNSError|ConnectionError|curl: \(\d+\)')
+
+
+class _ErroresYahoo(logging.Handler):
+    """Collect the failed downloads that yf.download logs, as '[tickers]: error', from the calling thread."""
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.hilo = threading.get_ident()
+        self.errores = {}
+
+    def emit(self, record):
+        if record.thread != self.hilo:
+            return
+        fallo = re.match(r'(\[.*?\]): (.*)', record.getMessage(), re.S)
+        if fallo is None:
+            return
+        try:
+            tickers = ast.literal_eval(fallo.group(1))
+        except (ValueError, SyntaxError):
+            return
+        self.errores.update({ticker: fallo.group(2) for ticker in tickers})
+
+
+def fetch_acciones(tickers):
+    """Fetch the last closing price of several stocks/CEDEARs with a single yfinance download.
+
+    yf.download doesn't raise the errors of each ticker: it logs them and leaves its columns empty.
+    They are read from its log, so that timeouts, connection errors and rate limits come back as
+    ErrorTransitorio and are retried and counted by the limiter and circuit breaker of the source.
+    A download that brought no data and logged nothing is also taken as transient.
+
+    Args:
+        tickers (list): The distinct ticker symbols.
+
+    Returns:
+        dict: Maps each ticker to its last closing price and date (datetime.date), or to the
+        raised exception when yfinance returned no data for it.
+    """
+    logger = logging.getLogger('yfinance')
+    errores = _ErroresYahoo()
+    logger.addHandler(errores)
+    try:
+        data = yf.download(tickers, period="5d", interval="1d", group_by='column', progress=False, timeout=TIMEOUT[1])
+    finally:
+        logger.removeHandler(errores)
+
+    cierres = data['Close'] if 'Close' in data else pd.DataFrame()
+    if isinstance(cierres, pd.Series):
+        cierres = cierres.to_frame(name=tickers[0])
+
+    resultados = {}
+    for ticker in tickers:
+        error = errores.errores.get(ticker.upper())
+        if error is not None and _ERRORES_TRANSITORIOS_YF.search(error):
+            resultados[ticker] = ErrorTransitorio(f"{ticker}: {error}")
+            continue
+        try:
+            serie = cierres[ticker].dropna()
+            resultados[ticker] = (float(serie.iloc[-1]), serie.index[-1].to_pydatetime().date())
+        except Exception as e:
+            resultados[ticker] = e
+
+    if not errores.errores and all(isinstance(r, Exception) for r in resultados.values()):
+        resultados = {ticker: ErrorTransitorio(f"{ticker}: yfinance no devolvio datos") for ticker in tickers}
+    return resultados
+
+
+def fetch_usd(ticker=None):
+    """Fetch the current USD blue buy rate from bluelytics, memoized per run by usd_blue.
+
+    Args:
+        ticker (str): Unused, kept so every fetcher shares the same signature.
+
+    Returns:
+        tuple: The blue buy rate and today's date (datetime.date).
+    """
+    return usd_blue()
+
+
+FETCHERS = {
+    'fci': fetch_fci,
+    'usd': fetch_usd
+    }
+
+# Sources fetched with one request for all their tickers instead of one request per ticker. yfinance is
+# only fetched this way: yf.download keeps shared state that concurrent downloads from the pool would mix up.
+BATCH_FETCHERS = {
+    'yf': fetch_acciones
+    }
+
+
+def crear_quote_cache(cursor):
+    """Create the quote_cache table if it doesn't exist.
+
+    Args:
+        cursor: A cursor of the database connection.
+
+    Returns:
+        None
+    """
+    cursor.execute("""CREATE TABLE IF NOT EXISTS quote_cache(
+    ticker VARCHAR(100),
+    source VARCHAR(10),
+    price FLOAT,
+    as_of_date TIMESTAMP,
+    fetched_at TIMESTAMP,
+    PRIMARY KEY(source, ticker)
+    )""")
+
+
+def leer_cache(cursor, jobs, ttl=None):
+    """Read the cached quotes fetched within the TTL.
+
+    Args:
+        cursor: A cursor of the database connection.
+        jobs (iterable): (source, ticker) tuples to look up.
+        ttl (datetime.timedelta): Maximum age of a cached quote. Defaults to CACHE_TTL.
+
+    Returns:
+        dict: Maps each (source, ticker) pair found in the cache to its price and quote date.
+    """
+    limite = dt.datetime.now() - (ttl if ttl is not None else CACHE_TTL)
+    crear_quote_cache(cursor)
+    cursor.execute('SELECT source, ticker, price, as_of_date FROM quote_cache WHERE fetched_at >= ?',
+                   (limite.isoformat(timespec='seconds'),))
+    vigentes = {(source, ticker): (price, dt.date.fromisoformat(as_of_date))
+                for source, ticker, price, as_of_date in cursor.fetchall()}
+    return {job: vigentes[job] for job in jobs if job in vigentes}
+
+
+def leer_ultimo_cache(cursor, jobs):
+    """Read the last cached quotes regardless of their age.
+
+    Args:
+        cursor: A cursor of the database connection.
+        jobs (iterable): (source, ticker) tuples to look up.
+
+    Returns:
+        dict: Maps each (source, ticker) pair found in the cache to its price and quote date.
+    """
+    crear_quote_cache(cursor)
+    cursor.execute('SELECT source, ticker, price, as_of_date FROM quote_cache')
+    ultimos = {(source, ticker): (price, dt.date.fromisoformat(as_of_date))
+               for source, ticker, price, as_of_date in cursor.fetchall()}
+    return {job: ultimos[job] for job in jobs if job in ultimos}
+
+
+def escribir_cache(cursor, cotizaciones):
+    """Store fetched quotes in the cache and evict the entries older than CACHE_RETENTION.
+
+    Args:
+        cursor: A cursor of the database connection.
+        cotizaciones (dict): Maps (source, ticker) pairs to their price and quote date. Failed
+            fetches (exceptions) are not stored.
+
+    Returns:
+        None
+    """
+    ahora = dt.datetime.now()
+    parametros = [(ticker, source, float(cotizacion[0]), str(cotizacion[1]), ahora.isoformat(timespec='seconds'))
+                  for (source, ticker), cotizacion in cotizaciones.items() if not isinstance(cotizacion, Exception)]
+
+    crear_quote_cache(cursor)
+    cursor.executemany('INSERT OR REPLACE INTO quote_cache(ticker, source, price, as_of_date, fetched_at) VALUES(?, ?, ?, ?, ?)', parametros)
+    cursor.execute('DELETE FROM quote_cache WHERE fetched_at < ?', ((ahora - CACHE_RETENTION).isoformat(timespec='seconds'),))
+
+
+def fetch_all(jobs, cursor=None, ttl=None, progreso=None):
+    """Fetch several quotes concurrently.
+
+    Every distinct (source, ticker) pair is fetched once on a shared thread pool. Requests against
+    each source go through its LimitadorAdaptativo (at most MAX_CONCURRENCIA in flight) and
+    CircuitBreaker, with timeouts and bounded retries (see _llamar). Sources listed in
+    BATCH_FETCHERS are fetched with a single request holding all their tickers.
+
+    When a cursor is given, quotes found in the quote_cache table within the TTL are returned
+    without touching the network, and the newly fetched ones are written back to it. Quotes whose
+    fetch failed, for instance because their source circuit is open, are returned as a
+    CotizacionEnCache holding the last cached quote if there is one.
+
+    When progreso is given, it is called as progreso(hechos, fallidos, total) once the cache was
+    read and again every time a fetch finishes, from the worker thread that ran it.
+
+    Args:
+        jobs (iterable): (source, ticker) tuples, where source is a key of FETCHERS or BATCH_FETCHERS.
+        cursor: A cursor of the database connection holding quote_cache. Optional.
+        ttl (datetime.timedelta): Maximum age of a cached quote. Defaults to CACHE_TTL.
+
+    Returns:
+        dict: Maps each (source, ticker) pair to the fetcher result, or to the raised exception (or
+        CotizacionEnCache) if the fetch failed.
+    """
+    jobs = list(dict.fromkeys(jobs))
+
+    cacheados = {}
+    if cursor is not None:
+        try:
+            cacheados = leer_cache(cursor, jobs, ttl=ttl)
+        except Exception as e:
+            print("Error quote_cache: ", e)
+        jobs = [job for job in jobs if job not in cacheados]
+
+    contador = {'hechos': len(cacheados), 'fallidos': 0, 'total': len(jobs) + len(cacheados)}
+    contador_lock = threading.Lock()
+
+    def _avisar(resultados):
+        if progreso is None:
+            return
+        with contador_lock:
+            for resultado in resultados:
+                contador['fallidos' if isinstance(resultado, Exception) else 'hechos'] += 1
+            progreso(contador['hechos'], contador['fallidos'], contador['total'])
+
+    _avisar([])
+
+    if not jobs:
+        return cacheados
+
+    lotes = {}
+    for source, ticker in jobs:
+        if source in BATCH_FETCHERS:
+            lotes.setdefault(source, []).append(ticker)
+
+    def _run(source, ticker):
+        try:
+            resultado = _llamar(source, FETCHERS[source], ticker)
+        except Exception as e:
+            resultado = e
+        _avisar([resultado])
+        return resultado
+
+    def _run_lote(source, tickers):
+        try:
+            resultados = _llamar(source, BATCH_FETCHERS[source], tickers)
+        except Exception as e:
+            resultados = {ticker: e for ticker in tickers}
+        _avisar(resultados.values())
+        return resultados
+
+    with ThreadPoolExecutor(max_workers=sum(MAX_CONCURRENCIA.values())) as executor:
+        futures = {job: executor.submit(_run, *job) for job in jobs if job[0] not in lotes}
+        futures_lotes = {source: executor.submit(_run_lote, source, tickers) for source, tickers in lotes.items()}
+
+    resultados = {job: future.result() for job, future in futures.items()}
+    for source, future in futures_lotes.items():
+        resultados.update({(source, ticker): resultado for ticker, resultado in future.result().items()})
+
+    if cursor is not None:
+        try:
+            escribir_cache(cursor, resultados)
+            fallidos = [job for job, resultado in resultados.items() if isinstance(resultado, Exception)]
+            for job, cotizacion in leer_ultimo_cache(cursor, fallidos).items():
+                resultados[job] = CotizacionEnCache(cotizacion, resultados[job])
+        except Exception as e:
+            print("Error quote_cache: ", e)
+
+    resultados.update(cacheados)
+    return resultados
@@ -0,0 +1,125 @@
+import datetime as dt
+import threading
+import uuid
+try:
+    from db_conn import conexionDB
+    from functions import actualizar, appendear_historical
+    from hist_arrow import exportar_historial
+except:
+    from utils.db_conn import conexionDB
+    from utils.functions import actualizar, appendear_historical
+    from utils.hist_arrow import exportar_historial
+
+
+class RefreshJob:
+    """Class representing a background refresh of the portfolio prices.
+
+    Attributes:
+        job_id (str): The identifier of the job.
+        estado (str): 'corriendo' while it runs, then 'ok' or 'error'.
+        hechos (int): Number of quotes fetched successfully so far.
+        fallidos (int): Number of quotes whose fetch failed so far.
+        total (int): Number of quotes to fetch, known once the refresh is planned.
+        error (str): The error message if the job failed.
+        inicio (datetime.datetime): When the job started.
+        fin (datetime.datetime): When the job finished, or None while it runs.
+    """
+
+    def __init__(self):
+        """Initialize a job that has just started."""
+        self.job_id = uuid.uuid4().hex[:8]
+        self.estado = 'corriendo'
+        self.hechos = 0
+        self.fallidos = 0
+        self.total = 0
+        self.error = None
+        self.inicio = dt.datetime.now()
+        self.fin = None
+
+    def progreso(self, hechos, fallidos, total):
+        """Record the fetch progress reported by actualizar."""
+        self.hechos = hechos
+        self.fallidos = fallidos
+        self.total = total
+
+    @property
+    def terminado(self):
+        """bool: Whether the job already finished, successfully or not."""
+        return self.estado != 'corriendo'
+
+    def __str__(self):
+        """
+        Return a string representation of the job.
+
+        Returns:
+            str: A string representation of the job.
+        """
+        return f'''RefreshJob[{self.job_id}, {self.estado}, {self.hechos}/{self.total}, {self.fallidos} fallidos]'''
+
+
+# Finished jobs are kept this long, so every session polling one can still read how it ended.
+RETENCION_JOBS = dt.timedelta(minutes=10)
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+def _purgar_jobs():
+    """Drop the jobs that finished more than RETENCION_JOBS ago. Must be called holding _jobs_lock."""
+    limite = dt.datetime.now() - RETENCION_JOBS
+    for job_id in [job_id for job_id, job in _jobs.items() if job.terminado and job.fin is not None and job.fin < limite]:
+        del _jobs[job_id]
+
+
+def _ejecutar(job):
+    """Run actualizar, appendear_historical and the Arrow export of the history for a job on its own database connection."""
+    try:
+        conexion = conexionDB()
+        try:
+            actualizar(conexion, progreso=job.progreso)
+            appendear_historical(conexion)
+            exportar_historial(conexion)
+        finally:
+            conexion.cerrar()
+        job.estado = 'ok'
+    except Exception as e:
+        print("Error refresh job: ", e)
+        job.error = str(e)
+        job.estado = 'error'
+    job.fin = dt.datetime.now()
+
+
+def lanzar_actualizacion():
+    """Start a background refresh of prices and history.
+
+    Only one refresh runs at a time: if a job is already running, its id is returned instead of
+    starting a new one. Jobs finished more than RETENCION_JOBS ago are forgotten.
+
+    Returns:
+        str: The id of the running job.
+    """
+    with _jobs_lock:
+        _purgar_jobs()
+        for job in _jobs.values():
+            if not job.terminado:
+                return job.job_id
+
+        job = RefreshJob()
+        _jobs[job.job_id] = job
+
+    threading.Thread(target=_ejecutar, args=(job,), name=f'refresh-{job.job_id}', daemon=True).start()
+    return job.job_id
+
+
+def estado_actualizacion(job_id):
+    """Return the job with a given id.
+
+    Args:
+        job_id (str): The id returned by lanzar_actualizacion.
+
+    Returns:
+        RefreshJob: The job, or None if the id is unknown or it finished more than RETENCION_JOBS ago.
+    """
+    with _jobs_lock:
+        _purgar_jobs()
+        return _jobs.get(job_id)
@@ -1,5 +1,9 @@
 import streamlit as st
 import plotly.graph_objects as go
+try:
+    from refresh_jobs import estado_actualizacion
+except:
+    from utils.refresh_jobs import estado_actualizacion
 
 
 categoria_label_concat_def = {
@@ -22,6 +26,34 @@ def generar_espacios(n):
     return "&nbsp;" * n
 
 
+@st.fragment(run_every=2)
+def mostrar_progreso_actualizacion():
+    """Display the progress of the background refresh stored in the session.
+
+    The fragment reruns on its own every 2 seconds while the refresh runs, so the rest of the page
+    stays usable. Once the job commits, the whole page is rerun to load the new data.
+
+    Returns:
+        None
+    """
+    job = estado_actualizacion(st.session_state.get('refresh_job'))
+    if job is None:
+        st.session_state.pop('refresh_job', None)
+        return
+
+    if not job.terminado:
+        avance = (job.hechos + job.fallidos) / job.total if job.total else 0.0
+        st.progress(avance, text=f"Actualizando {job.hechos}/{job.total} tickers, {job.fallidos} fallidos ⏳")
+        return
+
+    del st.session_state['refresh_job']
+    if job.estado == 'ok':
+        st.toast(f'Actualizado: {job.hechos} tickers, {job.fallidos} fallidos', icon='🥳')
+        st.rerun()
+    else:
+        st.error(f"Error actualizando: {job.error}", icon="⚠️")
+
+
 def mostrar_resumen_categoria(categoria, df_last, df_agrupado_bis, df_agrupado_ticker_resumen, df_hist_day_cat_summ, df_last_ticker_summ, color):
     """Display a summary of financial data for a specific category.
 
@@ -2,6 +2,9 @@ import requests
 import os
 
 
+TELEGRAM_URL = os.environ.get('ST_TELEGRAM_URL', 'https://api.telegram.org')
+
+
 def telegram_bot_sendtext(bot_message):
     """Send a text message via Telegram bot.
 
@@ -20,7 +23,7 @@ def telegram_bot_sendtext(bot_message):
     """
     bot_token = os.environ.get('ST_BOT_TOKEN')
     bot_chatID = os.environ.get('ST_BOT_CHATID')
-    send_text = 'https://api.telegram.org/bot' + bot_token + '/sendMessage?chat_id=' + bot_chatID + '&parse_mode=Markdown&text=' + bot_message
+    send_text = TELEGRAM_URL + '/bot' + bot_token + '/sendMessage?chat_id=' + bot_chatID + '&parse_mode=Markdown&text=' + bot_message
 
     response = requests.get(send_text)
 